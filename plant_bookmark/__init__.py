@@ -0,0 +1,63 @@
+"""Extract the vegetation colours of plant photos and render them as bookmarks.
+
+Submodules are imported on first use, so that table-only or render-only runs
+do not pay for importing torch.
+"""
+
+import importlib
+
+_EXPORTS = {
+    "VegAnnModel": "model",
+    "load_model": "model",
+    "load_compiled_model": "model",
+    "get_shared_model": "model",
+    "INFERENCE_MODES": "inference_modes",
+    "optimize_for_inference": "inference",
+    "compare_inference_modes": "inference",
+    "PlantImageDataset": "segmentation",
+    "segment_folder": "segmentation",
+    "segment_image_tiled": "segmentation",
+    "colorTransform_VegGround": "masks",
+    "COLOR_BACKENDS": "colors",
+    "detect_image_properties": "colors",
+    "extract_dominant_colors": "colors",
+    "palette_strip": "colors",
+    "annotate_image_properties": "vision",
+    "detect_image_properties_batch": "vision",
+    "FakeVisionClient": "vision",
+    "MaskColorWriter": "tables",
+    "process_csv_single_param": "tables",
+    "add_colour_space_columns": "tables",
+    "process_csv_with_colour": "tables",
+    "aggregate_color_tables": "tables",
+    "generate_colored_voronoi": "render",
+    "generate_colored_voronoi_raster": "render",
+    "generate_floral_pattern": "render",
+    "floral_layout": "render",
+    "resolve_overlaps": "render",
+    "rasterize_discs": "render",
+    "generate_palette_contact_sheet": "render",
+    "render_cached": "render",
+    "ColourStore": "colour_store",
+    "colour_records": "colour_store",
+    "BookmarkGeometry": "vector",
+    "voronoi_geometry": "vector",
+    "floral_geometry": "vector",
+    "export_bookmark": "vector",
+    "ColourHistogram": "histogram",
+    "histogram_palette_table": "histogram",
+    "PipelineManifest": "manifest",
+    "run_pipeline": "pipeline",
+    "Profiler": "profiling",
+    "profile_run": "profiling",
+    "load_jobs": "scheduler",
+    "run_jobs": "scheduler",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        return getattr(importlib.import_module("." + _EXPORTS[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,315 @@
+"""Benchmarks of every pipeline stage on synthetic plant photos and colour tables.
+
+Run ``python -m plant_bookmark.benchmark OUTPUT_FOLDER`` and compare two runs
+with ``--compare``. Segmentation uses a randomly initialised VegAnnModel, so
+no checkpoint download is needed; without torch the segmentation stages are
+skipped and synthetic masks are used instead.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+
+import numpy as np
+import pandas as pd
+from PIL import Image, ImageDraw, ImageFilter
+
+from .colors import extract_dominant_colors
+from .figures import use_headless_backend
+from .histogram import ColourHistogram
+from .masks import colorTransform_VegGround
+from .profiling import peak_rss
+from .render import generate_colored_voronoi, generate_colored_voronoi_raster, generate_floral_pattern
+from .tables import aggregate_color_tables, concatenate_csv, process_csv, process_csv_with_colour
+
+BENCHMARK_STAGES = (
+    "segment", "colorTransform_VegGround", "extract_dominant_colors", "colour_histogram", "process_csv",
+    "concatenate_csv", "hsv_conversion", "aggregate_color_tables", "voronoi", "voronoi_raster", "floral_pattern",
+)
+
+
+def synthetic_plant_image(rng, width=1024, height=768):
+    """
+    Draws a vegetation-like photo: a sky and soil background with overlapping
+    blurred leaves in varied greens and a little sensor noise.
+
+    Returns:
+    - The (height, width, 3) uint8 RGB image and its (height, width) uint8
+      vegetation mask.
+    """
+    horizon = int(height * rng.uniform(0.2, 0.5))
+    image = Image.new("RGB", (width, height), tuple(int(c) for c in rng.integers([60, 40, 20], [140, 100, 70])))
+    ImageDraw.Draw(image).rectangle([0, 0, width, horizon], fill=tuple(int(c) for c in rng.integers([120, 160, 200],
+                                                                                                    [200, 220, 255])))
+    mask = Image.new("L", (width, height), 0)
+    draw, mask_draw = ImageDraw.Draw(image), ImageDraw.Draw(mask)
+    for _ in range(int(rng.integers(40, 120))):
+        cx, cy = rng.uniform(0, width), rng.uniform(horizon * 0.5, height)
+        rx, ry = rng.uniform(0.01, 0.08) * width, rng.uniform(0.01, 0.06) * height
+        green = (int(rng.integers(10, 110)), int(rng.integers(90, 230)), int(rng.integers(0, 90)))
+        box = [cx - rx, cy - ry, cx + rx, cy + ry]
+        draw.ellipse(box, fill=green)
+        mask_draw.ellipse(box, fill=1)
+    image = image.filter(ImageFilter.GaussianBlur(1.5))
+    rgb = np.asarray(image).astype(np.int16) + rng.integers(-8, 9, (height, width, 3), dtype=np.int16)
+    return np.clip(rgb, 0, 255).astype(np.uint8), np.asarray(mask, dtype=np.uint8)
+
+
+def synthetic_color_table(rng, n_colors=10):
+    # 与 Vision/k-means 主色表相同的 r,g,b,radio 格式，偏绿色
+    rgb = np.column_stack([rng.integers(0, 120, n_colors), rng.integers(60, 240, n_colors),
+                           rng.integers(0, 110, n_colors)])
+    fractions = np.sort(rng.dirichlet(np.ones(n_colors)))[::-1]
+    return np.column_stack([rgb, fractions])
+
+
+def make_dataset(folder, n_images=16, width=1024, height=768, n_tables=100, seed=0):
+    """
+    Writes n_images synthetic JPEG photos to folder/photos and n_tables
+    synthetic dominant colour tables to folder/csv.
+
+    Returns:
+    - The photos folder, the csv folder and the list of synthetic masks.
+    """
+    rng = np.random.default_rng(seed)
+    photo_folder, csv_folder = os.path.join(folder, "photos"), os.path.join(folder, "csv")
+    os.makedirs(photo_folder, exist_ok=True)
+    os.makedirs(csv_folder, exist_ok=True)
+    masks = {}
+    for i in range(n_images):
+        rgb, mask = synthetic_plant_image(rng, width, height)
+        filename = f"synthetic_{i:04d}.jpg"
+        Image.fromarray(rgb).save(os.path.join(photo_folder, filename), quality=90)
+        masks[filename] = mask
+    for i in range(n_tables):
+        pd.DataFrame(synthetic_color_table(rng), columns=['r', 'g', 'b', 'radio']).to_csv(
+            os.path.join(csv_folder, f"synthetic_{i:04d}.png.csv"), index=False)
+    return photo_folder, csv_folder, masks
+
+
+class _Timer:
+    # 每个阶段重复 repeat 次，记录每次的耗时
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = {}
+
+    def run(self, stage, fn, items):
+        times = []
+        # 各阶段自己的打印输出会淹没结果，计时时丢弃
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for _ in range(self.repeat):
+                start = time.perf_counter()
+                fn()
+                times.append(time.perf_counter() - start)
+        self.results[stage] = {
+            'items': items,
+            'repeat': self.repeat,
+            'min_s': min(times),
+            'median_s': statistics.median(times),
+            'mean_s': statistics.mean(times),
+            'per_item_ms': min(times) / max(items, 1) * 1000,
+            'peak_rss_mb': None if peak_rss() is None else round(peak_rss() / 2 ** 20, 1),
+        }
+        print(f"{stage:>26}: {min(times):8.3f}s min, {statistics.median(times):8.3f}s median ({items} items)")
+
+
+def _segment_stage(timer, photo_folder, batch_size, num_workers):
+    import torch
+
+    from .model import FoldedVegAnn, VegAnnModel
+    from .segmentation import segment_folder
+
+    # 随机初始化的模型，速度与训练好的权重相同，无需下载检查点
+    torch.manual_seed(0)
+    model = VegAnnModel("Unet", "resnet34", in_channels=3, out_classes=1, encoder_weights=None).eval()
+    folded = FoldedVegAnn(model).eval()
+    outputs = {}
+
+    def keep(filename, im, pred):
+        outputs[filename] = (im, pred)
+
+    n_photos = len(os.listdir(photo_folder))
+    timer.run("segment", lambda: segment_folder(model, photo_folder, keep, batch_size=batch_size,
+                                                num_workers=num_workers), n_photos)
+    timer.run("segment_folded", lambda: segment_folder(folded, photo_folder, keep, batch_size=batch_size,
+                                                       num_workers=num_workers), n_photos)
+    return outputs
+
+
+def run_benchmarks(folder, n_images=16, width=1024, height=768, n_tables=100, repeat=3, batch_size=8,
+                   num_workers=None, skip=(), seed=0):
+    """
+    Generates the synthetic data in folder/data and times every stage.
+
+    Parameter:
+    - folder: The working folder; the results are written to
+      folder/benchmark_<time>.json and appended to folder/benchmark_history.csv.
+    - n_images, width, height: The synthetic photos.
+    - n_tables: The synthetic per-image colour tables used by the table stages.
+    - repeat: The number of runs of each stage; min and median are reported.
+    - batch_size, num_workers: Passed to segment_folder.
+    - skip: Stages of BENCHMARK_STAGES not to run.
+
+    Returns:
+    - The results dict that was saved.
+    """
+    data_folder = os.path.join(folder, "data")
+    work_folder = os.path.join(folder, "work")
+    os.makedirs(work_folder, exist_ok=True)
+    photo_folder, csv_folder, masks = make_dataset(data_folder, n_images, width, height, n_tables, seed)
+    timer = _Timer(repeat)
+
+    # 分割结果供后续阶段使用；没有 torch 时使用合成图像自带的掩膜
+    segmented = None
+    if "segment" not in skip:
+        try:
+            segmented = _segment_stage(timer, photo_folder, batch_size, num_workers)
+        except ImportError as e:
+            print(f"Skipping segmentation: {e}")
+    if segmented is None:
+        segmented = {filename: (np.asarray(Image.open(os.path.join(photo_folder, filename)).convert('RGB')), mask)
+                     for filename, mask in masks.items()}
+    pairs = list(segmented.values())
+
+    if "colorTransform_VegGround" not in skip:
+        timer.run("colorTransform_VegGround",
+                  lambda: [colorTransform_VegGround(im, pred, 1, 0, masked_only=True) for im, pred in pairs], len(pairs))
+    if "extract_dominant_colors" not in skip:
+        timer.run("extract_dominant_colors",
+                  lambda: [extract_dominant_colors(im, 0.005, mask=pred) for im, pred in pairs], len(pairs))
+    if "colour_histogram" not in skip:
+        def fold_histogram():
+            histogram = ColourHistogram(space="Lab")
+            for im, pred in pairs:
+                histogram.add(im, mask=pred)
+            histogram.palette()
+        timer.run("colour_histogram", fold_histogram, len(pairs))
+
+    tables = sorted(os.path.join(csv_folder, f) for f in os.listdir(csv_folder))
+    processed_folder = os.path.join(work_folder, "processed_csv")
+    combined = os.path.join(work_folder, "combined.csv")
+    hsv_table = os.path.join(work_folder, "combined_HSV.csv")
+    # 后续阶段依赖前面的输出，即使跳过计时也先生成一次
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for table in tables:
+            process_csv(table, processed_folder)
+        concatenate_csv(combined, processed_folder)
+        process_csv_with_colour(combined, hsv_table)
+
+    if "process_csv" not in skip:
+        timer.run("process_csv", lambda: [process_csv(table, processed_folder) for table in tables], len(tables))
+    if "concatenate_csv" not in skip:
+        timer.run("concatenate_csv", lambda: concatenate_csv(combined, processed_folder), len(tables))
+    if "hsv_conversion" not in skip:
+        timer.run("hsv_conversion", lambda: process_csv_with_colour(combined, hsv_table), len(tables))
+    if "aggregate_color_tables" not in skip:
+        timer.run("aggregate_color_tables",
+                  lambda: aggregate_color_tables(csv_folder, combined, hsv_table), len(tables))
+
+    if "voronoi" not in skip:
+        timer.run("voronoi", lambda: generate_colored_voronoi(hsv_table, os.path.join(work_folder, "voronoi.png"),
+                                                              seed=seed, show=False), 1)
+    if "voronoi_raster" not in skip:
+        timer.run("voronoi_raster", lambda: generate_colored_voronoi_raster(
+            hsv_table, os.path.join(work_folder, "voronoi_raster.png"), seed=seed), 1)
+    if "floral_pattern" not in skip:
+        timer.run("floral_pattern", lambda: generate_floral_pattern(hsv_table, os.path.join(work_folder, "floral.png"),
+                                                                    show=False), 1)
+
+    results = {
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'commit': _git_commit(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'params': {'n_images': n_images, 'width': width, 'height': height, 'n_tables': n_tables,
+                   'repeat': repeat, 'batch_size': batch_size, 'seed': seed},
+        'stages': timer.results,
+    }
+    save_results(results, folder)
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(results, folder):
+    # 每次运行一个 JSON 文件，另外追加到 benchmark_history.csv 便于横向比较
+    stamp = results['time'].replace(':', '').replace('-', '')
+    json_path = os.path.join(folder, f"benchmark_{stamp}.json")
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=1)
+    rows = pd.DataFrame([dict(stage=stage, time=results['time'], commit=results['commit'], **stats)
+                         for stage, stats in results['stages'].items()])
+    history = os.path.join(folder, "benchmark_history.csv")
+    rows.to_csv(history, mode='a', header=not os.path.exists(history), index=False)
+    print(f"Benchmark results saved as {json_path}")
+    return json_path
+
+
+def compare_results(baseline_path, results_path):
+    """
+    Compares two saved benchmark runs stage by stage.
+
+    Returns:
+    - A DataFrame of the min times and the ratio new / baseline; ratios above
+      1 are slowdowns.
+    """
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)['stages']
+    with open(results_path, encoding='utf-8') as f:
+        new = json.load(f)['stages']
+    rows = [{
+        'stage': stage,
+        'baseline_s': baseline[stage]['min_s'],
+        'new_s': new[stage]['min_s'],
+        'ratio': new[stage]['min_s'] / baseline[stage]['min_s'] if baseline[stage]['min_s'] else None,
+    } for stage in new if stage in baseline]
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    # 计时中不能有 plt.show() 的等待，图像只写入文件
+    use_headless_backend()
+    parser = argparse.ArgumentParser(prog="python -m plant_bookmark.benchmark",
+                                     description="Time every pipeline stage on synthetic plant photos.")
+    parser.add_argument("folder", help="working folder for the synthetic data and the results")
+    parser.add_argument("--images", type=int, default=16, help="number of synthetic photos")
+    parser.add_argument("--size", default="1024x768", help="WIDTHxHEIGHT of the synthetic photos")
+    parser.add_argument("--tables", type=int, default=100, help="number of synthetic colour tables")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each stage")
+    parser.add_argument("--batch-size", type=int, default=8, help="photos per forward pass")
+    parser.add_argument("--num-workers", type=int, help="image decoding threads")
+    parser.add_argument("--skip", default="", help="comma separated stages not to run, from %s"
+                                                   % ", ".join(BENCHMARK_STAGES))
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument("--compare", metavar="BASELINE_JSON", help="compare with an earlier benchmark_*.json")
+    args = parser.parse_args(argv)
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    skip = {stage.strip() for stage in args.skip.split(",") if stage.strip()}
+    unknown = skip - set(BENCHMARK_STAGES)
+    if unknown:
+        parser.error("unknown stage(s): %s" % ", ".join(sorted(unknown)))
+
+    os.makedirs(args.folder, exist_ok=True)
+    results = run_benchmarks(args.folder, args.images, width, height, args.tables, args.repeat, args.batch_size,
+                             args.num_workers, skip, args.seed)
+    if args.compare:
+        stamp = results['time'].replace(':', '').replace('-', '')
+        print(compare_results(args.compare, os.path.join(args.folder, f"benchmark_{stamp}.json")).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
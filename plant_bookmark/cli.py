@@ -0,0 +1,154 @@
+"""Command line entry points: ``plant-bookmark INPUT_PATH EXPORT_PATH`` and
+``plant-bookmark-batch JOBS_CSV EXPORT_ROOT``."""
+
+import argparse
+import os
+
+from .figures import use_headless_backend
+from .histogram import HISTOGRAM_SPACES
+from .inference_modes import INFERENCE_MODES
+from .pipeline import STAGES, run_pipeline
+
+
+def add_pipeline_arguments(parser):
+    # 单个文件夹和批量运行共用的选项
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help="comma separated stages to run, from %s (default: all)" % ", ".join(STAGES))
+    parser.add_argument("--checkpoint", default="VegAnn.ckpt", help="VegAnn checkpoint used by the segment stage")
+    parser.add_argument("--color-backend", default="kmeans", help="dominant colour backend: kmeans or vision")
+    parser.add_argument("--disk-colors", action="store_true",
+                        help="extract colours from the seg/ PNGs instead of the in-memory masks")
+    parser.add_argument("--colour-store", action="store_true",
+                        help="keep the per-image colours in one memory-mapped store instead of one CSV per image")
+    parser.add_argument("--save-seg-png", action="store_true", help="also write seg/ PNGs in memory mode")
+    parser.add_argument("--inference-mode", default="fp32", choices=INFERENCE_MODES,
+                        help="CPU inference mode of the segment stage (default: fp32)")
+    parser.add_argument("--calibration-path", help="photo folder used to calibrate --inference-mode int8")
+    parser.add_argument("--batch-size", type=int, default=8, help="photos per forward pass")
+    parser.add_argument("--tile-size", type=int,
+                        help="segment at full resolution in tiles of this size (a multiple of 32) instead of 384x512")
+    parser.add_argument("--tile-overlap", type=int, default=64, help="pixels shared by neighbouring tiles")
+    parser.add_argument("--num-workers", type=int, help="image decoding threads")
+    parser.add_argument("--colour-spaces", default="HSV", help="comma separated colour spaces: HSV, Lab, LCh")
+    parser.add_argument("--histogram-space", choices=HISTOGRAM_SPACES,
+                        help="also fold the vegetation pixels into a colour histogram in this space")
+    parser.add_argument("--palette-from", default="images", choices=("images", "histogram"),
+                        help="build the season table from the per-image colours or the colour histogram")
+    parser.add_argument("--palette-colors", type=int, default=30, help="colours of a histogram palette")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the Voronoi pattern")
+    parser.add_argument("--vector-formats", default="",
+                        help="comma separated vector formats of the bookmarks: svg, pdf")
+    parser.add_argument("--print-dpis", default="",
+                        help="comma separated resolutions the bookmarks are also rasterized at, e.g. 300,600")
+    parser.add_argument("--print-width-mm", type=float, help="printed width of the vector and print exports")
+    parser.add_argument("--cache-dir", help="render cache folder (default: EXPORT_PATH/.render_cache)")
+    parser.add_argument("--no-profile", action="store_true",
+                        help="do not write the time and memory report to EXPORT_PATH/profile/")
+    parser.add_argument("--trace", action="store_true", help="also write a Chrome trace to EXPORT_PATH/profile/")
+
+
+def pipeline_options(parser, args):
+    # 检查选项并转换为 run_pipeline 的参数
+    if args.inference_mode == "int8" and not args.calibration_path:
+        parser.error("--inference-mode int8 needs --calibration-path")
+    if args.tile_size is not None and (args.tile_size <= 0 or args.tile_size % 32):
+        parser.error("--tile-size must be a positive multiple of 32")
+    vector_formats = [fmt.strip().lower() for fmt in args.vector_formats.split(",") if fmt.strip()]
+    if any(fmt not in ("svg", "pdf") for fmt in vector_formats):
+        parser.error("--vector-formats takes svg and/or pdf")
+    try:
+        print_dpis = [int(dpi) for dpi in args.print_dpis.split(",") if dpi.strip()]
+    except ValueError:
+        parser.error("--print-dpis takes comma separated integers")
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error("unknown stage(s): %s" % ", ".join(unknown))
+
+    return dict(
+        stages=stages,
+        checkpoint=args.checkpoint,
+        color_backend=args.color_backend,
+        in_memory_colors=not args.disk_colors,
+        save_seg_png=args.save_seg_png,
+        colour_store=args.colour_store,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        spaces=tuple(space.strip() for space in args.colour_spaces.split(",") if space.strip()),
+        seed=args.seed,
+        cache_dir=args.cache_dir,
+        vector_formats=tuple(vector_formats),
+        print_dpis=tuple(print_dpis),
+        print_width_mm=args.print_width_mm,
+        inference_mode=args.inference_mode,
+        calibration_path=args.calibration_path,
+        tile_size=args.tile_size,
+        tile_overlap=args.tile_overlap,
+        histogram_space=args.histogram_space,
+        palette_source=args.palette_from,
+        palette_colors=args.palette_colors,
+        profile=not args.no_profile,
+        trace=args.trace,
+    )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="plant-bookmark",
+        description="Extract the vegetation colours of a photo folder and render them as bookmarks.",
+    )
+    parser.add_argument("input_path", help="folder containing the original photos")
+    parser.add_argument("export_path", help="folder the tables and images are written to")
+    parser.add_argument("--base-name", help="name of the combined table and bookmarks (default: input folder name)")
+    add_pipeline_arguments(parser)
+    parser.add_argument("--merge-histograms", nargs="+", metavar="NPZ",
+                        help="colour_histogram.npz files combined into the histogram palette (default: the one of EXPORT_PATH)")
+    return parser
+
+
+def main(argv=None):
+    # 命令行运行没有显示器，图像只写入文件
+    use_headless_backend()
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    options = pipeline_options(parser, args)
+    base_name = args.base_name or os.path.basename(os.path.normpath(args.input_path))
+
+    run_pipeline(args.input_path, args.export_path, base_name, histogram_paths=args.merge_histograms, **options)
+    return 0
+
+
+def build_batch_parser():
+    parser = argparse.ArgumentParser(
+        prog="plant-bookmark-batch",
+        description="Run the bookmark pipeline for every (park, season, input folder) job of a CSV file.",
+    )
+    parser.add_argument("jobs", help="CSV file with the columns park, season, input_path "
+                                     "and optionally export_path, base_name")
+    parser.add_argument("export_root", help="jobs without export_path write to EXPORT_ROOT/park/season")
+    parser.add_argument("--segment-workers", type=int,
+                        help="segmentation processes (default: a quarter of the CPUs left to them)")
+    parser.add_argument("--io-workers", type=int,
+                        help="processes for the colours, aggregate and render stages (default: cpu count / 4, at most 4)")
+    parser.add_argument("--status", help="JSON file the per-job progress is written to "
+                                         "(default: EXPORT_ROOT/schedule_status.json)")
+    add_pipeline_arguments(parser)
+    return parser
+
+
+def batch_main(argv=None):
+    from .scheduler import load_jobs, run_jobs
+
+    use_headless_backend()
+    parser = build_batch_parser()
+    args = parser.parse_args(argv)
+    options = pipeline_options(parser, args)
+
+    os.makedirs(args.export_root, exist_ok=True)
+    statuses = run_jobs(load_jobs(args.jobs, args.export_root), segment_workers=args.segment_workers,
+                        io_workers=args.io_workers,
+                        status_path=args.status or os.path.join(args.export_root, "schedule_status.json"),
+                        **options)
+    failed = [job for job in statuses if job["state"] == "failed"]
+    print(f"{len(statuses) - len(failed)} job(s) done, {len(failed)} failed")
+    return 1 if failed else 0
@@ -0,0 +1,195 @@
+"""Dominant colour extraction from segmented images."""
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+
+def detect_image_properties_vision(image_path,threshold):
+    from google.cloud import vision
+
+    client = vision.ImageAnnotatorClient()
+
+    # 读取图像文件
+    with open(image_path, 'rb') as image_file:
+        content = image_file.read()
+
+    image = vision.Image(content=content)
+
+    # 发送图像请求以检测属性
+    response = client.image_properties(image=image)
+
+    # 解析检测结果
+    properties = response.image_properties_annotation
+    return vision_color_matrix(properties, threshold)
+
+
+def vision_color_matrix(properties, threshold):
+    # 获取主色调
+    main_colors = properties.dominant_colors.colors
+
+    # 提取 pixel_fraction 值大于threshold的颜色信息，并将其转换为多维矩阵
+    color_matrix = [
+        [color.color.red,color.color.green,color.color.blue,color.pixel_fraction]#
+
+        for color in main_colors
+        if color.pixel_fraction >= threshold
+    ]
+
+    color_matrix = np.array(color_matrix)
+    return color_matrix
+
+
+def _nearest_center(pixels, centers, chunk_size=65536):
+    # 分块计算每个像素最近的聚类中心，避免一次性生成过大的距离矩阵
+    labels = np.empty(len(pixels), dtype=np.intp)
+    for i in range(0, len(pixels), chunk_size):
+        chunk = pixels[i:i + chunk_size]
+        labels[i:i + chunk_size] = ((chunk[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+    return labels
+
+
+def kmeans_centers(points, n_colors, n_iter, rng, weights=None):
+    """
+    Clusters (N, 3) points with k-means++ initialisation and Lloyd iterations.
+
+    Parameter:
+    - points: The float points to cluster.
+    - n_colors: The maximum number of clusters.
+    - n_iter: The maximum number of iterations.
+    - rng: The numpy Generator used for the initialisation.
+    - weights: Optional (N,) weights, e.g. the pixel counts of histogram bins.
+
+    Returns:
+    - The (k, 3) cluster centres, k <= n_colors.
+    """
+    # k-means++ 初始化聚类中心
+    if weights is None:
+        centers = [points[rng.integers(len(points))]]
+    else:
+        centers = [points[rng.choice(len(points), p=weights / weights.sum())]]
+    dist = ((points - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, n_colors):
+        score = dist if weights is None else dist * weights
+        if score.sum() == 0:
+            break
+        center = points[rng.choice(len(points), p=score / score.sum())]
+        centers.append(center)
+        dist = np.minimum(dist, ((points - center) ** 2).sum(axis=1))
+    centers = np.array(centers)
+
+    for _ in range(n_iter):
+        labels = _nearest_center(points, centers)
+        counts = np.bincount(labels, weights=weights, minlength=len(centers))
+        point_weights = [points[:, c] if weights is None else points[:, c] * weights for c in range(3)]
+        sums = np.stack([np.bincount(labels, weights=w, minlength=len(centers)) for w in point_weights], axis=1)
+        new_centers = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centers)
+        converged = np.abs(new_centers - centers).max() < 0.5
+        centers = new_centers
+        if converged:
+            break
+    return centers
+
+
+def extract_dominant_colors(rgb, threshold, mask=None, n_colors=10, max_samples=20000, n_iter=20, seed=0):
+    """
+    Finds the dominant colours of an image locally with k-means, as a drop-in
+    replacement for the Google Vision image_properties call.
+
+    Parameter:
+    - rgb: An (H, W, 3) or (H, W, 4) RGB image array in the 0-255 range.
+    - threshold: Colours with a pixel fraction below it are dropped.
+    - mask: Optional (H, W) array; only pixels where it is non-zero are used.
+    - n_colors: The number of clusters, 10 like the Vision API.
+    - max_samples: The clusters are fitted on at most this many random pixels.
+    - n_iter: The maximum number of k-means iterations.
+    - seed: Seed for pixel sampling and centre initialisation.
+
+    Returns:
+    - A numpy array of [r, g, b, pixel_fraction] rows sorted by pixel fraction,
+      where pixel_fraction is the share of the used pixels in the cluster.
+    """
+    pixels = np.asarray(rgb)[..., :3].reshape(-1, 3)
+    if mask is not None:
+        pixels = pixels[np.asarray(mask).reshape(-1) != 0]
+    if len(pixels) == 0:
+        return np.empty((0, 4))
+    pixels = pixels.astype(np.float32)
+
+    rng = np.random.default_rng(seed)
+    if len(pixels) > max_samples:
+        sample = pixels[rng.choice(len(pixels), max_samples, replace=False)]
+    else:
+        sample = pixels
+
+    centers = kmeans_centers(sample, n_colors, n_iter, rng)
+
+    # 用全部像素统计每种颜色所占比例
+    fractions = np.bincount(_nearest_center(pixels, centers), minlength=len(centers)) / len(pixels)
+    order = np.argsort(-fractions)
+    color_matrix = np.column_stack([np.round(centers), fractions])[order]
+    return color_matrix[color_matrix[:, 3] >= threshold]
+
+
+def detect_image_properties_kmeans(image_path,threshold):
+    rgb = np.asarray(Image.open(image_path).convert('RGB'))
+    return extract_dominant_colors(rgb, threshold)
+
+
+# 可选的主色提取方式，新的方式按 (image_path, threshold) 签名注册即可
+COLOR_BACKENDS = {
+    "vision": detect_image_properties_vision,
+    "kmeans": detect_image_properties_kmeans,
+}
+
+
+# 直接对数组提取主色的方式，可用于内存模式
+ARRAY_COLOR_BACKENDS = {
+    "kmeans": extract_dominant_colors,
+}
+
+
+def detect_image_properties(image_path,threshold,backend="vision"):
+    return COLOR_BACKENDS[backend](image_path, threshold)
+
+
+def palette_strip(colors, swatch_width=100, height=100):
+    """
+    Builds the swatch strip of a colour table: one swatch_width wide block per
+    colour, side by side.
+
+    Parameter:
+    - colors: An (N, 3+) array of r, g, b rows, e.g. a color_matrix.
+    - swatch_width, height: The size of every swatch in pixels.
+
+    Returns:
+    - An (height, swatch_width * N, 3) uint8 RGB image.
+    """
+    colors = np.asarray(colors, dtype=np.float64)
+    if colors.size == 0:
+        return np.zeros((height, 0, 3), dtype=np.uint8)
+    rgb = np.clip(np.round(colors[:, :3]), 0, 255).astype(np.uint8)
+    # 每个颜色沿列方向重复 swatch_width 次，行方向只是广播
+    row = np.repeat(rgb, swatch_width, axis=0)
+    return np.ascontiguousarray(np.broadcast_to(row, (height,) + row.shape))
+
+
+# function to visualize array of colors
+def palette(colors):
+    import matplotlib.pyplot as plt
+
+    # input: array of RGB colors
+    if len(colors) > 0:
+        plt.xticks([])
+        plt.yticks([])
+        plt.axis('off')  # 隐藏坐标轴
+        plt.imshow(palette_strip(colors))
+    return
+
+
+def save_colors_to_csv(color_matrix, output_csv_path):
+    # 将颜色数据转换为Pandas DataFrame
+    df = pd.DataFrame(list(color_matrix), columns=['r', 'g', 'b', 'radio'])
+    # 保存到CSV文件
+    df.to_csv(output_csv_path, index=False)
+    print(df)
@@ -0,0 +1,203 @@
+"""A single append-only, memory-mapped store of the per-image colour records."""
+
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+
+# 每条记录一行：主色 r,g,b、像素比例 radio、去掉暗色后的 Ratio，以及 HSV
+RECORD_DTYPE = np.dtype([
+    ('r', '<f8'), ('g', '<f8'), ('b', '<f8'), ('radio', '<f8'), ('Ratio', '<f8'),
+    ('Hue', '<f8'), ('Saturation', '<f8'), ('Value', '<f8'),
+])
+# 与 process_csv_single_param 相同：r+g+b 小于该值的颜色不参与 Ratio
+DARK_THRESHOLD = 60
+
+
+def colour_records(color_matrix):
+    """
+    Converts an [r, g, b, pixel_fraction] colour matrix to store records.
+    Ratio is computed over the colours with r + g + b >= 60, like
+    process_csv_single_param, and is NaN for the darker ones.
+
+    Returns:
+    - A structured array of RECORD_DTYPE.
+    """
+    from .tables import rgb_to_hsv_array
+
+    color_matrix = np.asarray(color_matrix, dtype=np.float64).reshape(-1, 4)
+    records = np.zeros(len(color_matrix), dtype=RECORD_DTYPE)
+    if not len(records):
+        return records
+    for i, name in enumerate(('r', 'g', 'b', 'radio')):
+        records[name] = color_matrix[:, i]
+    kept = color_matrix[:, :3].sum(axis=1) >= DARK_THRESHOLD
+    records['Ratio'] = np.where(kept, color_matrix[:, 3] / color_matrix[kept, 3].sum(), np.nan) if kept.any() else np.nan
+    hsv = np.asarray(rgb_to_hsv_array(color_matrix[:, :3] / 255.0)).reshape(-1, 3)
+    records['Hue'], records['Saturation'], records['Value'] = hsv[:, 0], hsv[:, 1], hsv[:, 2]
+    return records
+
+
+class ColourStore:
+    """
+    The dominant colours of all images of a folder in one binary file of
+    fixed-size records (RECORD_DTYPE), plus a small index of which records
+    belong to which image, in place of one CSV file per image.
+
+    Writes append the records of an image to the end of the file and then one
+    line to the index, so an interrupted write leaves the store consistent:
+    records not yet in the index and an incomplete last index line are
+    dropped.
+    Writing an image again appends its new records and the index points to
+    them; compact() drops the superseded ones. Reads memory-map the file, so
+    records(image_id) is a view into the file without parsing or copying.
+
+    Parameter:
+    - path: The store folder, created if needed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.records_path = os.path.join(path, 'records.bin')
+        self.index_path = os.path.join(path, 'index.csv')
+        os.makedirs(path, exist_ok=True)
+        self._index = {}
+        self._end = 0
+        self._map = None
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as f:
+                data = f.read()
+            # 每行以换行符结束；中断时写了一半的最后一行不完整（数字也可能被截短），丢掉并截断
+            complete = data[:data.rfind(b'\n') + 1]
+            if len(complete) < len(data):
+                with open(self.index_path, 'r+b') as f:
+                    f.truncate(len(complete))
+            for image_id, start, count in csv.reader(complete.decode('utf-8').splitlines()):
+                self._index[image_id] = (int(start), int(count))
+                self._end = max(self._end, int(start) + int(count))
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, image_id):
+        return image_id in self._index
+
+    @property
+    def ids(self):
+        # 按写入顺序排列的图片
+        return list(self._index)
+
+    def append(self, image_id, color_matrix):
+        """
+        Stores the colours of an image, replacing any earlier ones.
+
+        Parameter:
+        - image_id: The key, e.g. the name of the segmented image.
+        - color_matrix: The [r, g, b, pixel_fraction] rows, or records from
+          colour_records.
+
+        Returns:
+        - The number of records written.
+        """
+        records = color_matrix if getattr(color_matrix, 'dtype', None) == RECORD_DTYPE else colour_records(color_matrix)
+        with open(self.records_path, 'ab') as f:
+            # 去掉上次中断时写了一半、未记入索引的记录
+            f.truncate(self._end * RECORD_DTYPE.itemsize)
+            f.write(records.tobytes())
+        with open(self.index_path, 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerow([image_id, self._end, len(records)])
+        self._index[image_id] = (self._end, len(records))
+        self._end += len(records)
+        self._map = None
+        return len(records)
+
+    def _records_map(self):
+        if self._map is None:
+            if self._end == 0:
+                return np.zeros(0, dtype=RECORD_DTYPE)
+            self._map = np.memmap(self.records_path, dtype=RECORD_DTYPE, mode='r', shape=(self._end,))
+        return self._map
+
+    def records(self, image_id=None):
+        """
+        Returns the records of image_id as a read-only view into the
+        memory-mapped file; without image_id, the records of all images in
+        write order, which is also a view unless images were rewritten
+        since the last compact().
+        """
+        records = self._records_map()
+        if image_id is not None:
+            start, count = self._index[image_id]
+            return records[start:start + count]
+        spans = sorted(self._index.values())
+        if sum(count for _, count in spans) == self._end:
+            return records
+        return np.concatenate([records[start:start + count] for start, count in spans])
+
+    def color_matrix(self, image_id):
+        # 与 csv/ 中每张图的表格相同的 [r, g, b, radio] 矩阵
+        records = self.records(image_id)
+        return np.column_stack([records['r'], records['g'], records['b'], records['radio']])
+
+    def table(self, spaces=None, drop_dark=True):
+        """
+        Builds the combined colour table of all images, with the columns and
+        rows (ordered by image name) of the combined CSV written by
+        aggregate_color_tables: the
+        colours with r + g + b >= 60 and the columns r, g, b, radio, Ratio
+        and id (the image name up to the first dot). The values equal those
+        of the CSV path within float tolerance (about 1e-12): the store keeps
+        the exact floats, while the per-image CSV files round them.
+
+        Parameter:
+        - spaces: Colour spaces to add, see COLOUR_SPACES; "HSV" is taken
+          from the stored columns.
+        - drop_dark: Like process_csv_single_param; with False every colour
+          is kept and Ratio is taken over all colours of the image.
+
+        Returns:
+        - A DataFrame.
+        """
+        from .tables import add_colour_space_columns
+
+        records = self._records_map()
+        frames = []
+        # 与逐个读取 csv/ 时相同，按图片名排序
+        for image_id, (start, count) in sorted(self._index.items()):
+            part = records[start:start + count]
+            if drop_dark:
+                part = part[~np.isnan(part['Ratio'])]
+            if not len(part):
+                continue
+            frame = pd.DataFrame({name: part[name] for name in ('r', 'g', 'b', 'radio')})
+            # 与 process_csv_single_param 相同，Ratio 按保留下来的颜色计算
+            frame['Ratio'] = frame['radio'] / frame['radio'].sum()
+            frame['id'] = image_id.split('.')[0]
+            if spaces and "HSV" in spaces:
+                for name in ('Hue', 'Saturation', 'Value'):
+                    frame[name] = part[name]
+            frames.append(frame)
+        if not frames:
+            return pd.DataFrame(columns=['r', 'g', 'b', 'radio', 'Ratio', 'id'])
+        df = pd.concat(frames, ignore_index=True)
+        other_spaces = [space for space in spaces or () if space != "HSV"]
+        return add_colour_space_columns(df, other_spaces) if other_spaces else df
+
+    def compact(self):
+        # 只保留每张图片最新的记录，先写临时文件再改名；两次改名之间不要中断
+        records = self._records_map()
+        tmp_records, tmp_index = self.records_path + '.tmp', self.index_path + '.tmp'
+        index, end = {}, 0
+        with open(tmp_records, 'wb') as f:
+            for image_id, (start, count) in self._index.items():
+                f.write(records[start:start + count].tobytes())
+                index[image_id] = (end, count)
+                end += count
+        with open(tmp_index, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows([image_id, start, count] for image_id, (start, count) in index.items())
+        self._map = None
+        del records
+        os.replace(tmp_records, self.records_path)
+        os.replace(tmp_index, self.index_path)
+        self._index, self._end = index, end
+        return end
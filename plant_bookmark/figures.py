@@ -0,0 +1,62 @@
+"""Matplotlib figures that work both in notebooks and in headless batch runs."""
+
+import os
+import sys
+
+HEADLESS_BACKEND = "Agg"
+# 这些后端只能写文件，plt.show() 不显示任何内容
+_NON_INTERACTIVE_BACKENDS = {"agg", "cairo", "pdf", "pgf", "ps", "svg", "template"}
+
+
+def use_headless_backend():
+    """
+    Switches matplotlib to the Agg backend for batch runs without a display,
+    e.g. the command line and the scheduler workers. Figures are then only
+    written to files and previews are skipped (see can_show).
+    """
+    os.environ["MPLBACKEND"] = HEADLESS_BACKEND
+    if "matplotlib" in sys.modules:
+        import matplotlib
+
+        matplotlib.use(HEADLESS_BACKEND)
+
+
+def can_show():
+    # 当前后端能否显示图像，例如 Colab/Jupyter 的 inline 后端
+    import matplotlib
+
+    return matplotlib.get_backend().lower() not in _NON_INTERACTIVE_BACKENDS
+
+
+def new_figure(show, **kwargs):
+    """
+    Creates a figure and its axes. Figures that will be shown are created
+    through pyplot; the others are plain Figure objects that pyplot does not
+    keep track of, so they are freed as soon as they go out of scope.
+
+    Parameter:
+    - show: Whether the figure will be passed to show_figure.
+    - kwargs: Passed to plt.subplots / Figure.subplots, e.g. figsize or ncols.
+
+    Returns:
+    - The figure and its axes, like plt.subplots.
+    """
+    figure_kwargs = {key: kwargs.pop(key) for key in ("figsize", "dpi") if key in kwargs}
+    if show:
+        import matplotlib.pyplot as plt
+
+        return plt.subplots(**figure_kwargs, **kwargs)
+    from matplotlib.figure import Figure
+
+    fig = Figure(**figure_kwargs)
+    return fig, fig.subplots(**kwargs)
+
+
+def show_figure(fig, show):
+    # 显示后立即关闭，避免每张照片的图像一直留在 pyplot 中
+    if not show:
+        return
+    import matplotlib.pyplot as plt
+
+    plt.show()
+    plt.close(fig)
@@ -0,0 +1,182 @@
+"""Streaming 3D colour histograms of vegetation pixels and the season palette."""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from .colors import _nearest_center, kmeans_centers
+
+HISTOGRAM_SPACES = ("RGB", "Lab")
+
+# RGB 每个通道量化到 64 级后查表得到 Lab 分箱，只需转换 64³ 个颜色
+_LAB_LUT_LEVELS = 64
+_LAB_LUTS = {}
+
+
+def _lab_bin_lut(bins):
+    if bins not in _LAB_LUTS:
+        from .tables import rgb_to_lab_normalized
+
+        step = 256 // _LAB_LUT_LEVELS
+        levels = (np.arange(_LAB_LUT_LEVELS) * step + step / 2) / 255.0
+        grid = np.stack(np.meshgrid(levels, levels, levels, indexing="ij"), axis=-1).reshape(-1, 3)
+        lab = rgb_to_lab_normalized(grid)
+        _LAB_LUTS[bins] = _lab_to_bin(lab, bins).reshape((_LAB_LUT_LEVELS,) * 3)
+    return _LAB_LUTS[bins]
+
+
+def _lab_to_bin(lab, bins):
+    # L 取 0-100，a、b 取 -128-128，各自等分为 bins 份
+    lo, hi = np.array([0.0, -128.0, -128.0]), np.array([100.0, 128.0, 128.0])
+    idx = np.clip(((lab - lo) / (hi - lo) * bins).astype(np.intp), 0, bins - 1)
+    return ((idx[:, 0] * bins + idx[:, 1]) * bins + idx[:, 2]).astype(np.int32)
+
+
+class ColourHistogram:
+    """
+    A fixed-size 3D histogram of pixel colours that images are folded into one
+    at a time, so its memory use does not depend on the number of images.
+
+    Besides the pixel count of every bin it keeps the sum of the RGB values
+    falling into it, so the palette colours are the mean colours of the
+    pixels rather than bin centres. Histograms with the same bins and space
+    can be merged, e.g. after processing the folders of a season in parallel.
+
+    Parameter:
+    - bins: The number of bins per axis, 32 gives 32³ bins.
+    - space: "RGB", or "Lab" to bin in CIE Lab so that the palette clusters
+      colours perceptually.
+    """
+    def __init__(self, bins=32, space="RGB"):
+        if space not in HISTOGRAM_SPACES:
+            raise ValueError(f"unknown histogram space {space!r}, expected one of {HISTOGRAM_SPACES}")
+        self.bins = bins
+        self.space = space
+        self.counts = np.zeros(bins ** 3, dtype=np.int64)
+        self.rgb_sums = np.zeros((bins ** 3, 3), dtype=np.float64)
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    def bin_index(self, pixels):
+        # pixels 为 (N, 3) 的 uint8 RGB
+        if self.space == "Lab":
+            q = pixels >> 2
+            return _lab_bin_lut(self.bins)[q[:, 0], q[:, 1], q[:, 2]]
+        idx = pixels.astype(np.intp) * self.bins >> 8
+        return (idx[:, 0] * self.bins + idx[:, 1]) * self.bins + idx[:, 2]
+
+    def add(self, rgb, mask=None):
+        """
+        Folds the pixels of an image into the histogram.
+
+        Parameter:
+        - rgb: An (H, W, 3) or (H, W, 4) uint8 RGB image.
+        - mask: Optional (H, W) array; only pixels where it is non-zero count.
+
+        Returns:
+        - The number of pixels added.
+        """
+        pixels = np.asarray(rgb)[..., :3].reshape(-1, 3)
+        if mask is not None:
+            pixels = pixels[np.asarray(mask).reshape(-1) != 0]
+        pixels = pixels.astype(np.uint8, copy=False)
+        idx = self.bin_index(pixels)
+        size = self.bins ** 3
+        self.counts += np.bincount(idx, minlength=size)
+        for c in range(3):
+            self.rgb_sums[:, c] += np.bincount(idx, weights=pixels[:, c], minlength=size)
+        return len(pixels)
+
+    def merge(self, other):
+        if (other.bins, other.space) != (self.bins, self.space):
+            raise ValueError("only histograms with the same bins and space can be merged")
+        self.counts += other.counts
+        self.rgb_sums += other.rgb_sums
+        return self
+
+    __iadd__ = merge
+
+    def save(self, path):
+        # 先写临时文件再改名，中断时不会留下不完整的文件
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(tmp_path, bins=self.bins, space=self.space, counts=self.counts, rgb_sums=self.rgb_sums)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            histogram = cls(int(data["bins"]), str(data["space"]))
+            histogram.counts[:] = data["counts"]
+            histogram.rgb_sums[:] = data["rgb_sums"]
+        return histogram
+
+    @classmethod
+    def merge_files(cls, paths):
+        histogram = None
+        for path in paths:
+            part = cls.load(path)
+            histogram = part if histogram is None else histogram.merge(part)
+        return histogram
+
+    def bin_coordinates(self):
+        # 每个分箱中心在直方图色彩空间中的坐标
+        centers = (np.arange(self.bins) + 0.5) / self.bins
+        grid = np.stack(np.meshgrid(centers, centers, centers, indexing="ij"), axis=-1).reshape(-1, 3)
+        if self.space == "Lab":
+            return grid * [100.0, 256.0, 256.0] + [0.0, -128.0, -128.0]
+        return grid * 256.0
+
+    def palette(self, n_colors=30, threshold=0.0, n_iter=50, seed=0):
+        """
+        Derives a palette from the histogram by clustering the occupied bins,
+        weighted by their pixel counts, in the histogram's colour space.
+
+        Returns:
+        - A numpy array of [r, g, b, pixel_fraction] rows sorted by pixel
+          fraction, like extract_dominant_colors, where r, g, b is the mean
+          colour of the pixels in the cluster.
+        """
+        occupied = np.flatnonzero(self.counts)
+        if len(occupied) == 0:
+            return np.empty((0, 4))
+        weights = self.counts[occupied].astype(np.float64)
+        points = self.bin_coordinates()[occupied]
+        centers = kmeans_centers(points, n_colors, n_iter, np.random.default_rng(seed), weights=weights)
+
+        labels = _nearest_center(points, centers)
+        counts = np.bincount(labels, weights=weights, minlength=len(centers))
+        keep = counts > 0
+        rgb = np.stack([np.bincount(labels, weights=self.rgb_sums[occupied, c], minlength=len(centers))
+                        for c in range(3)], axis=1)[keep] / counts[keep, None]
+        fractions = counts[keep] / weights.sum()
+        order = np.argsort(-fractions)
+        color_matrix = np.column_stack([np.round(rgb), fractions])[order]
+        return color_matrix[color_matrix[:, 3] >= threshold]
+
+
+def histogram_palette_table(histogram, table_id, n_colors=30, spaces=("HSV",), drop_dark=False):
+    """
+    Builds a season colour table from a merged histogram, with the same
+    columns as the tables written by aggregate_color_tables, so the
+    renderers can use it in their place.
+
+    Parameter:
+    - histogram: The merged ColourHistogram.
+    - table_id: The value of the 'id' column, e.g. the base name.
+    - n_colors: The number of palette colours.
+    - spaces: The colour spaces added, see COLOUR_SPACES.
+    - drop_dark: Drop the colours with r + g + b < 60 like
+      process_csv_single_param. The histogram only holds vegetation pixels,
+      so its dark colours are shaded leaves and are kept by default.
+    """
+    from .tables import add_colour_space_columns
+
+    df = pd.DataFrame(list(histogram.palette(n_colors)), columns=['r', 'g', 'b', 'radio'])
+    if drop_dark:
+        df = df[df[['r', 'g', 'b']].sum(axis=1) >= 60].copy()
+    df['Ratio'] = df['radio'] / df['radio'].sum()
+    df['id'] = table_id
+    return add_colour_space_columns(df, spaces)
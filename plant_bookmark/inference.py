@@ -0,0 +1,185 @@
+"""Faster CPU inference modes for the VegAnn network and their accuracy check."""
+
+import copy
+import os
+import time
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+import torch
+
+from .model import FoldedVegAnn
+from .inference_modes import INFERENCE_MODES
+from .segmentation import PlantImageDataset, collate_images, load_images, segment_folder
+
+
+def bf16_available():
+    # 只有支持 bf16 指令的 CPU 上 autocast 才会变快
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def available_inference_modes():
+    return tuple(mode for mode in INFERENCE_MODES if mode != "bf16" or bf16_available())
+
+
+class OptimizedVegAnn(torch.nn.Module):
+    """
+    A FoldedVegAnn network run in one of INFERENCE_MODES. Like FoldedVegAnn it
+    takes raw 0-255 RGB batches and returns float32 logits.
+    """
+    raw_input = True
+
+    def __init__(self, folded: FoldedVegAnn, mode="fp32"):
+        super().__init__()
+        self.mode = mode
+        self.model = folded.model
+        self.register_buffer("scale", folded.scale)
+        self.register_buffer("bias", folded.bias)
+        if mode in ("channels_last", "bf16"):
+            self.model = self.model.to(memory_format=torch.channels_last)
+
+    def forward(self, image):
+        x = image.float() * self.scale + self.bias
+        if self.mode in ("channels_last", "bf16"):
+            x = x.contiguous(memory_format=torch.channels_last)
+        autocast = torch.autocast("cpu", dtype=torch.bfloat16) if self.mode == "bf16" else nullcontext()
+        with autocast:
+            logits = self.model(x)
+        return logits.float()
+
+
+def calibration_batches(calibration_path, n_images=16, batch_size=8, size=(384, 512)):
+    # 从校准文件夹取前 n_images 张照片，按原始 uint8 批次返回
+    filenames = sorted(os.listdir(calibration_path))[:n_images]
+    dataset = PlantImageDataset(calibration_path, filenames, size=size, normalize=False)
+    batch = []
+    for item in load_images(dataset):
+        if item[1] is not None:
+            batch.append(item)
+        if len(batch) == batch_size:
+            yield collate_images(batch)[2]
+            batch = []
+    if batch:
+        yield collate_images(batch)[2]
+
+
+def quantize_int8(folded, calibration_path, n_images=16, batch_size=8):
+    """
+    Statically quantizes the network of a FoldedVegAnn to INT8 with FX graph
+    mode, calibrating the activation ranges on photos of calibration_path.
+    The input affine stays in float.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    batches = list(calibration_batches(calibration_path, n_images, batch_size))
+    if not batches:
+        raise ValueError(f"no calibration photos in {calibration_path}")
+
+    def normalize(image):
+        return image.float() * folded.scale + folded.bias
+
+    qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+    prepared = prepare_fx(folded.model, qconfig_mapping, (normalize(batches[0]),))
+    with torch.inference_mode():
+        for batch in batches:
+            prepared(normalize(batch))
+    folded.model = convert_fx(prepared)
+    return folded
+
+
+def optimize_for_inference(model, mode="fp32", calibration_path=None, n_calibration=16):
+    """
+    Builds a copy of a VegAnnModel for faster CPU inference.
+
+    Parameter:
+    - model: A VegAnnModel with its weights loaded; it is not modified.
+    - mode: One of INFERENCE_MODES:
+      "fp32" the plain network, "channels_last" NHWC memory format,
+      "bf16" channels_last with bfloat16 autocast, "int8" static post-training
+      quantization calibrated on calibration_path.
+    - calibration_path: A folder of photos used to calibrate "int8"; keep it
+      apart from the folder used by compare_inference_modes.
+    - n_calibration: The number of calibration photos.
+
+    Returns:
+    - An eval-mode network taking raw 0-255 RGB batches (raw_input is set).
+    """
+    if mode not in INFERENCE_MODES:
+        raise ValueError(f"unknown inference mode {mode!r}, expected one of {INFERENCE_MODES}")
+    if mode == "bf16" and not bf16_available():
+        raise RuntimeError("bf16 inference needs a CPU with bfloat16 support")
+    folded = FoldedVegAnn(copy.deepcopy(model)).eval()
+    if mode == "int8":
+        if calibration_path is None:
+            raise ValueError("int8 inference needs a calibration_path")
+        folded = quantize_int8(folded, calibration_path, n_images=n_calibration)
+    return OptimizedVegAnn(folded, mode).eval()
+
+
+def mask_iou(reference, pred):
+    # 两个掩膜都为空时记为完全一致
+    reference, pred = np.asarray(reference) != 0, np.asarray(pred) != 0
+    union = np.logical_or(reference, pred).sum()
+    if union == 0:
+        return 1.0
+    return float(np.logical_and(reference, pred).sum() / union)
+
+
+def compare_inference_modes(model, input_path, modes=None, calibration_path=None, tolerance=0.98,
+                            batch_size=8, num_workers=None):
+    """
+    Segments a held-out folder in every inference mode and compares the masks
+    with the fp32 masks.
+
+    Parameter:
+    - model: A VegAnnModel with its weights loaded.
+    - input_path: The held-out photo folder.
+    - modes: The modes to compare; defaults to available_inference_modes(),
+      without "int8" when no calibration_path is given.
+    - calibration_path: The calibration folder for "int8".
+    - tolerance: The lowest mean IoU against fp32 a mode may have.
+    - batch_size, num_workers: Passed to segment_folder.
+
+    Returns:
+    - A DataFrame with one row per mode (mode, seconds, seconds_per_image,
+      mean_iou, min_iou, within_tolerance), fastest first.
+    """
+    if modes is None:
+        modes = [mode for mode in available_inference_modes() if mode != "int8" or calibration_path is not None]
+    modes = ["fp32"] + [mode for mode in modes if mode != "fp32"]
+
+    reference = {}
+    rows = []
+    for mode in modes:
+        network = optimize_for_inference(model, mode, calibration_path=calibration_path)
+        masks = reference if mode == "fp32" else {}
+
+        def keep_mask(filename, im, pred):
+            masks[filename] = pred
+
+        start = time.perf_counter()
+        count = segment_folder(network, input_path, keep_mask, batch_size=batch_size, num_workers=num_workers)
+        seconds = time.perf_counter() - start
+
+        ious = [mask_iou(reference[filename], pred) for filename, pred in masks.items()]
+        rows.append({
+            "mode": mode,
+            "seconds": seconds,
+            "seconds_per_image": seconds / max(count, 1),
+            "mean_iou": float(np.mean(ious)) if ious else 1.0,
+            "min_iou": float(np.min(ious)) if ious else 1.0,
+        })
+
+    report = pd.DataFrame(rows)
+    report["within_tolerance"] = report["mean_iou"] >= tolerance
+    return report.sort_values("seconds").reset_index(drop=True)
+
+
+def fastest_mode(report):
+    # 在精度允许范围内选最快的模式，fp32 总是满足
+    return report.loc[report["within_tolerance"], "mode"].iloc[0]
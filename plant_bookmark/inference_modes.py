@@ -0,0 +1,4 @@
+"""Names of the CPU inference modes, importable without torch."""
+
+# 分割阶段可选的 CPU 推理模式，见 inference.optimize_for_inference
+INFERENCE_MODES = ("fp32", "channels_last", "bf16", "int8")
@@ -0,0 +1,142 @@
+"""Manifest of processed inputs for incremental runs."""
+
+import hashlib
+import json
+import os
+
+
+def file_sha1(file_path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PipelineManifest:
+    """
+    Records, for each pipeline stage, the size, mtime and SHA-1 of every input
+    file processed and the outputs produced from it, so that a re-run only
+    processes new or changed files.
+
+    The manifest is a JSON file. It is rewritten atomically every save_every
+    records and on close, so a run interrupted by a Colab disconnect resumes
+    from the last save.
+
+    Inputs are keyed by their name relative to the input folder and outputs
+    are stored relative to the manifest's folder, so running from another
+    working directory, with "./photos" instead of "photos", or after the
+    drive is mounted elsewhere does not make every file look new.
+
+    Parameter:
+    - path: The JSON file the manifest is kept in.
+    - save_every: The number of records between saves.
+    """
+    def __init__(self, path, save_every=20):
+        self.path = path
+        self.save_every = save_every
+        self._unsaved = 0
+        self._save_callbacks = []
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.stages = json.load(f)
+        else:
+            self.stages = {}
+
+    def _entry(self, stage, input_folder, filename):
+        entries = self.stages.get(stage, {})
+        entry = entries.get(filename)
+        legacy_key = os.path.join(input_folder, filename)
+        if entry is None and legacy_key in entries:
+            # 旧版本的清单以拼接后的路径为键，读到时改为相对于输入文件夹的文件名
+            entry = entries[filename] = entries.pop(legacy_key)
+            self._mark_unsaved()
+        return entry
+
+    def _output_exists(self, output):
+        # 相对于清单所在文件夹保存；旧清单中的路径相对于当时的工作目录
+        return os.path.exists(os.path.join(os.path.dirname(self.path), output)) or os.path.exists(output)
+
+    def is_done(self, stage, input_folder, filename):
+        entry = self._entry(stage, input_folder, filename)
+        if entry is None or not all(self._output_exists(output) for output in entry['outputs']):
+            return False
+        input_file = os.path.join(input_folder, filename)
+        stat = os.stat(input_file)
+        if stat.st_size != entry['size']:
+            return False
+        if stat.st_mtime != entry['mtime']:
+            # 修改时间变了但内容可能没变（例如云盘重新同步），再比较哈希
+            if file_sha1(input_file) != entry['sha1']:
+                return False
+            entry['mtime'] = stat.st_mtime
+            self._mark_unsaved()
+        return True
+
+    def pending(self, stage, input_folder):
+        # 返回文件夹中尚未处理或已改动的文件名
+        return [filename for filename in sorted(os.listdir(input_folder))
+                if not self.is_done(stage, input_folder, filename)]
+
+    def recorded_outputs(self, stage, input_folder, filename):
+        # 上次处理时记录的输出（即使之后又改动过）；没有处理过时为 None
+        entry = self._entry(stage, input_folder, filename)
+        return None if entry is None else entry['outputs']
+
+    def recorded(self, stage):
+        # stage 记录过的所有输入文件名
+        return list(self.stages.get(stage, {}))
+
+    def reset_stage(self, stage):
+        self.stages[stage] = {}
+        self._mark_unsaved()
+
+    def record(self, stage, input_folder, filename, outputs):
+        """
+        Records filename of input_folder as processed by stage into outputs;
+        an empty outputs marks a file that was skipped, e.g. an unreadable
+        photo, so it is not retried until it changes.
+        """
+        input_file = os.path.join(input_folder, filename)
+        stat = os.stat(input_file)
+        self.stages.setdefault(stage, {})[filename] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha1': file_sha1(input_file),
+            'outputs': self._relative_outputs(outputs),
+        }
+        self._mark_unsaved()
+
+    def _relative_outputs(self, outputs):
+        base = os.path.dirname(self.path) or os.curdir
+        return [os.path.relpath(output, base) for output in outputs]
+
+    def copy_stage(self, source, target, outputs):
+        # 把 source 阶段的记录复制为 target 阶段已处理，输出改为 outputs（用于后来新增的阶段）
+        self.stages[target] = {input_file: dict(entry, outputs=self._relative_outputs(outputs))
+                               for input_file, entry in self.stages.get(source, {}).items()}
+        self._mark_unsaved()
+
+    def _mark_unsaved(self):
+        self._unsaved += 1
+        if self._unsaved >= self.save_every:
+            self.save()
+
+    def on_save(self, callback):
+        # 与清单一起保存的状态（例如颜色直方图）先于清单写出，记录过的文件不会在其中缺失
+        self._save_callbacks.append(callback)
+
+    def save(self):
+        for callback in self._save_callbacks:
+            callback()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.stages, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+        self._unsaved = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.save()
@@ -0,0 +1,54 @@
+"""Blending of vegetation masks into photos."""
+
+import numpy as np
+
+
+# colorTransform_VegGround 中背景与植被的混合颜色
+GROUND_COLOR = np.array([0, 0, 0])
+
+
+VEG_COLOR = np.array([34, 139, 34])
+
+
+def colorTransform_VegGround(im,X_true,alpha_vert,alpha_g,out=None,masked_only=False):
+    """
+    Blends the ground (X_true == 0) towards GROUND_COLOR with alpha_vert and the
+    vegetation (X_true == 1) towards VEG_COLOR with alpha_g, for all channels in
+    a single broadcast pass.
+
+    Parameter:
+    - im: An (H, W, 3) image or an (N, H, W, 3) batch of images.
+    - X_true: The vegetation mask with one value per pixel of im, e.g. (H, W),
+      (1, 1, H, W) or (N, 1, H, W).
+    - alpha_vert: The blend weight of the ground colour.
+    - alpha_g: The blend weight of the vegetation colour.
+    - out: Optional preallocated array shaped like im to write the result into.
+    - masked_only: Only keep the vegetation pixels and set the ground to black,
+      the same as alpha_vert=1 and alpha_g=0.
+
+    Returns:
+    - The blended image(s), with the dtype of im.
+    """
+    im = np.asarray(im)
+    mask = np.asarray(X_true).reshape(im.shape[:-1] + (1,)) != 0
+    if out is None:
+        out = np.empty_like(im)
+    if masked_only or (alpha_vert == 1 and alpha_g == 0):
+        # 只保留植被像素，不需要浮点运算
+        np.multiply(im, mask, out=out)
+        return out
+    if im.dtype == np.uint8:
+        # uint8 图像只有 256 个取值：预先算好 (类别, 通道, 取值) 查找表，一次索引完成混合
+        values = np.arange(256)[None, None, :]
+        alphas = np.array([alpha_vert, alpha_g])[:, None, None]
+        colors = np.stack([GROUND_COLOR, VEG_COLOR])[:, :, None]
+        lut = (values * (1 - alphas) + alphas * colors).astype(np.uint8).ravel()
+        idx = im.astype(np.uint16)
+        idx += np.arange(0, 768, 256, dtype=np.uint16)
+        idx += mask.astype(np.uint16) * 768
+        np.take(lut, idx, out=out)
+        return out
+    alpha = np.where(mask, alpha_g, alpha_vert)
+    color = np.where(mask, VEG_COLOR, GROUND_COLOR)
+    np.copyto(out, im * (1 - alpha) + alpha * color, casting='unsafe')
+    return out
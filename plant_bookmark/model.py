@@ -0,0 +1,241 @@
+"""VegAnn vegetation segmentation model."""
+
+import os
+from typing import Dict, List
+
+import pytorch_lightning as pl
+import segmentation_models_pytorch as smp
+import torch
+
+
+class VegAnnModel(pl.LightningModule):
+    def __init__(self, arch: str, encoder_name: str, in_channels: int, out_classes: int, **kwargs):
+        super().__init__()
+        self.model = smp.create_model(
+            arch,
+            encoder_name=encoder_name,
+            in_channels=in_channels,
+            classes=out_classes,
+            **kwargs,
+        )
+
+        # preprocessing parameteres for image
+        params = smp.encoders.get_preprocessing_params(encoder_name)
+        self.register_buffer("std", torch.tensor(params["std"]).view(1, 3, 1, 1))
+        self.register_buffer("mean", torch.tensor(params["mean"]).view(1, 3, 1, 1))
+
+        # for image segmentation dice loss could be the best first choice
+        self.loss_fn = smp.losses.DiceLoss(smp.losses.BINARY_MODE, from_logits=True)
+        self.train_outputs, self.val_outputs, self.test_outputs = [], [], []
+
+    def forward(self, image: torch.Tensor):
+        # normalize image here #todo
+        image = (image - self.mean) / self.std
+        mask = self.model(image)
+        return mask
+
+    def shared_step(self, batch: Dict, stage: str):
+        image = batch["image"]
+
+        # Shape of the image should be (batch_size, num_channels, height, width)
+        # if you work with grayscale images, expand channels dim to have [batch_size, 1, height, width]
+        assert image.ndim == 4
+
+        # Check that image dimensions are divisible by 32,
+        # encoder and decoder connected by `skip connections` and usually encoder have 5 stages of
+        # downsampling by factor 2 (2 ^ 5 = 32); e.g. if we have image with shape 65x65 we will have
+        # following shapes of features in encoder and decoder: 84, 42, 21, 10, 5 -> 5, 10, 20, 40, 80
+        # and we will get an error trying to concat these features
+        h, w = image.shape[2:]
+        assert h % 32 == 0 and w % 32 == 0
+
+        mask = batch["mask"]
+
+        # Shape of the mask should be [batch_size, num_classes, height, width]
+        # for binary segmentation num_classes = 1
+        assert mask.ndim == 4
+
+        # Check that mask values in between 0 and 1, NOT 0 and 255 for binary segmentation
+        assert mask.max() <= 1.0 and mask.min() >= 0
+
+        logits_mask = self.forward(image)
+
+        # Predicted mask contains logits, and loss_fn param `from_logits` is set to True
+        loss = self.loss_fn(logits_mask, mask)
+
+        # Lets compute metrics for some threshold
+        # first convert mask values to probabilities, then
+        # apply thresholding
+        prob_mask = logits_mask.sigmoid()
+        pred_mask = (prob_mask > 0.5).float()
+
+        # We will compute IoU metric by two ways
+        #   1. dataset-wise
+        #   2. image-wise
+        # but for now we just compute true positive, false positive, false negative and
+        # true negative 'pixels' for each image and class
+        # these values will be aggregated in the end of an epoch
+        tp, fp, fn, tn = smp.metrics.get_stats(pred_mask.long(), mask.long(), mode="binary")
+
+        return {
+            "loss": loss,
+            "tp": tp,
+            "fp": fp,
+            "fn": fn,
+            "tn": tn,
+        }
+
+    def shared_epoch_end(self, outputs: List[Dict], stage: str):
+        # aggregate step metics
+        tp = torch.cat([x["tp"] for x in outputs])
+        fp = torch.cat([x["fp"] for x in outputs])
+        fn = torch.cat([x["fn"] for x in outputs])
+        tn = torch.cat([x["tn"] for x in outputs])
+
+        # per image IoU means that we first calculate IoU score for each image
+        # and then compute mean over these scores
+        per_image_iou = smp.metrics.iou_score(tp, fp, fn, tn, reduction="micro-imagewise")
+        per_image_f1 = smp.metrics.f1_score(tp, fp, fn, tn, reduction="micro-imagewise")
+        per_image_acc = smp.metrics.accuracy(tp, fp, fn, tn, reduction="micro-imagewise")
+        # dataset IoU means that we aggregate intersection and union over whole dataset
+        # and then compute IoU score. The difference between dataset_iou and per_image_iou scores
+        # in this particular case will not be much, however for dataset
+        # with "empty" images (images without target class) a large gap could be observed.
+        # Empty images influence a lot on per_image_iou and much less on dataset_iou.
+        dataset_iou = smp.metrics.iou_score(tp, fp, fn, tn, reduction="micro")
+        dataset_f1 = smp.metrics.f1_score(tp, fp, fn, tn, reduction="micro")
+        dataset_acc = smp.metrics.accuracy(tp, fp, fn, tn, reduction="micro")
+
+        metrics = {
+            f"{stage}_per_image_iou": per_image_iou,
+            f"{stage}_dataset_iou": dataset_iou,
+            f"{stage}_per_image_f1": per_image_f1,
+            f"{stage}_dataset_f1": dataset_f1,
+            f"{stage}_per_image_acc": per_image_acc,
+            f"{stage}_dataset_acc": dataset_acc,
+        }
+
+        self.log_dict(metrics, prog_bar=True, sync_dist=True, rank_zero_only=True)
+
+    def training_step(self, batch: Dict, batch_idx: int):
+        step_outputs = self.shared_step(batch, "train")
+        self.train_outputs.append(step_outputs)
+        return step_outputs
+
+    def on_train_epoch_end(self):
+        self.shared_epoch_end(self.train_outputs, "train")
+        self.train_outputs = []
+
+    def validation_step(self, batch: Dict, batch_idx: int):
+        step_outputs = self.shared_step(batch, "valid")
+        self.val_outputs.append(step_outputs)
+        return step_outputs
+
+    def on_validation_epoch_end(self, *args, **kwargs):
+        self.shared_epoch_end(self.val_outputs, "valid")
+        self.val_outputs = []
+
+    def test_step(self, batch: Dict, batch_idx: int):
+        step_outputs = self.shared_step(batch, "test")
+        self.test_outputs.append(step_outputs)
+        return step_outputs
+
+    def on_test_epoch_end(self):
+        self.shared_epoch_end(self.test_outputs, "test")
+        self.test_outputs = []
+
+    def configure_optimizers(self):
+        return torch.optim.Adam(self.parameters(), lr=0.0001)
+
+
+def load_model(ckt_path, arch="Unet", encoder_name="resnet34"):
+    # 权重全部来自 checkpoint，构建模型时不再下载 imagenet 预训练权重
+    checkpoint = torch.load(ckt_path, map_location=torch.device('cpu'))
+    model = VegAnnModel(arch, encoder_name, in_channels=3, out_classes=1, encoder_weights=None)
+    model.load_state_dict(checkpoint["state_dict"])
+    model.eval()
+    return model
+
+
+class FoldedVegAnn(torch.nn.Module):
+    """
+    The network of a VegAnnModel with its input normalisation folded into a
+    single per-channel affine, taking 0-255 RGB batches (uint8 or float, NCHW).
+
+    The original pipeline normalises twice: get_preprocessing_fn scales to
+    0-1 and applies the imagenet mean/std, then VegAnnModel.forward applies
+    its mean/std buffers again. Both use the encoder's imagenet parameters, so
+    x -> ((x / 255 - mean) / std - mean) / std becomes x * scale + bias.
+    """
+    raw_input = True
+
+    def __init__(self, model: VegAnnModel):
+        super().__init__()
+        self.model = model.model
+        mean, std = model.mean.detach().clone(), model.std.detach().clone()
+        self.register_buffer("scale", 1 / (255 * std * std))
+        self.register_buffer("bias", -(mean / std + mean) / std)
+
+    def forward(self, image: torch.Tensor):
+        return self.model(image.float() * self.scale + self.bias)
+
+
+def load_compiled_model(ckt_path, arch="Unet", encoder_name="resnet34", example_size=(512, 384)):
+    """
+    Loads the eval-mode VegAnn network as TorchScript with the normalisation
+    folded in (see FoldedVegAnn), so it takes raw 0-255 RGB batches.
+
+    The traced artifact is cached next to the checkpoint as
+    <checkpoint>.<arch>-<encoder_name>.ts and reused while the checkpoint
+    size, mtime and the torch version are unchanged, which skips rebuilding
+    the model on later runs.
+
+    Parameter:
+    - ckt_path: The VegAnn checkpoint.
+    - arch, encoder_name: The architecture the checkpoint was trained with.
+    - example_size: (height, width) of the example input used for tracing;
+      the traced network accepts other sizes that are multiples of 32.
+    """
+    stat = os.stat(ckt_path)
+    key = f"{arch}/{encoder_name}/{stat.st_size}/{stat.st_mtime_ns}/{torch.__version__}"
+    cache_path = f"{os.path.splitext(ckt_path)[0]}.{arch}-{encoder_name}.ts"
+
+    if os.path.exists(cache_path):
+        extra_files = {"key": ""}
+        try:
+            module = torch.jit.load(cache_path, map_location="cpu", _extra_files=extra_files)
+        except RuntimeError:
+            module = None
+        if module is not None and extra_files["key"] == key.encode("utf-8"):
+            module.eval()
+            module.raw_input = True
+            return module
+
+    folded = FoldedVegAnn(load_model(ckt_path, arch, encoder_name)).eval()
+    with torch.inference_mode():
+        module = torch.jit.trace(folded, torch.zeros(1, 3, *example_size, dtype=torch.uint8))
+    # 先写临时文件再改名，多个进程同时生成缓存时不会读到不完整的文件
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    torch.jit.save(module, tmp_path, _extra_files={"key": key})
+    os.replace(tmp_path, cache_path)
+    module.eval()
+    module.raw_input = True
+    return module
+
+
+_SHARED_MODELS = {}
+
+
+def get_shared_model(ckt_path, arch="Unet", encoder_name="resnet34"):
+    """
+    Returns the compiled VegAnn network for ckt_path, loading it only once per
+    process. Its tensors are moved to shared memory, so worker processes
+    forked (or spawned through torch.multiprocessing) after this call use the
+    same weights instead of each holding a copy.
+    """
+    key = (os.path.abspath(ckt_path), arch, encoder_name)
+    if key not in _SHARED_MODELS:
+        module = load_compiled_model(ckt_path, arch, encoder_name)
+        module.share_memory()
+        _SHARED_MODELS[key] = module
+    return _SHARED_MODELS[key]
@@ -0,0 +1,484 @@
+"""Pipeline stages, from a folder of photos to the rendered bookmarks."""
+
+import os
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+
+from .colors import ARRAY_COLOR_BACKENDS, detect_image_properties, save_colors_to_csv
+from .colour_store import ColourStore
+from .figures import can_show, new_figure, show_figure
+from .histogram import ColourHistogram, histogram_palette_table
+from .manifest import PipelineManifest
+from .masks import colorTransform_VegGround
+from .profiling import profile_run, span
+from .render import (generate_colored_voronoi_raster, generate_floral_pattern, generate_palette_contact_sheet,
+                     render_cached)
+from .tables import COMBINED_COLUMNS, MaskColorWriter, aggregate_color_tables, write_empty_color_tables
+
+STAGES = ("segment", "colors", "aggregate", "render")
+
+
+def uses_in_memory_colors(in_memory_colors, color_backend):
+    # Google Vision 需要上传图片文件，只有数组方式的主色提取可以走内存模式
+    return in_memory_colors and color_backend in ARRAY_COLOR_BACKENDS
+
+
+def hsv_table_path(export_path, base_name):
+    return os.path.join(export_path, "processed_HSV_csv", base_name+'_processed_HSV.csv')
+
+
+def histogram_path(export_path):
+    return os.path.join(export_path, "colour_histogram.npz")
+
+
+def profile_path(export_path, stages=STAGES):
+    # 只运行部分阶段时（例如调度器分两次运行）写到 profile/<阶段>/，不覆盖其他阶段的报告
+    folder = os.path.join(export_path, "profile")
+    if set(STAGES) <= set(stages):
+        return folder
+    return os.path.join(folder, "+".join(stage for stage in STAGES if stage in stages))
+
+
+def colour_store_path(export_path):
+    return os.path.join(export_path, "colour_store")
+
+
+def pending_photos(manifest, input_path, hist_path=None):
+    """
+    Lists the photos the segment stage has to process: the new or changed
+    ones and, with hist_path, the ones not yet counted in that colour
+    histogram, e.g. after turning on histogram_space for an existing export.
+
+    A photo counted in the histogram cannot be taken out of it again, so
+    when a counted photo changed or was removed the histogram has to be
+    rebuilt from every photo of the folder.
+
+    Returns:
+    - The sorted file names, the set of those only needed for the
+      histogram, and whether the histogram has to be rebuilt.
+    """
+    filenames = manifest.pending("segment", input_path)
+    if hist_path is None:
+        return filenames, set(), False
+    if os.path.exists(hist_path) and "histogram" not in manifest.stages:
+        # 旧的清单没有单独记录直方图，已有的直方图是在分割时累加的，已分割的照片都已计入
+        manifest.copy_stage("segment", "histogram", [hist_path])
+    all_photos = sorted(os.listdir(input_path))
+    histogram_pending = manifest.pending("histogram", input_path)
+    # 计入过直方图（有输出，不是跳过的文件）但已改动或已删除的照片
+    changed = [filename for filename in histogram_pending
+               if manifest.recorded_outputs("histogram", input_path, filename)]
+    removed = set(manifest.recorded("histogram")) - set(all_photos)
+    rebuild = bool(changed or removed)
+    if rebuild:
+        histogram_pending = all_photos
+    histogram_only = set(histogram_pending) - set(filenames)
+    return sorted(set(filenames) | histogram_only), histogram_only, rebuild
+
+
+def _colour_saver(export_path, colour_store):
+    # 每张图的主色写成 csv/ 中的单独文件，或追加到 colour_store 中；返回记录到清单中的输出文件
+    if colour_store:
+        store = ColourStore(colour_store_path(export_path))
+
+        def save(image_id, colors):
+            store.append(image_id, colors)
+            return store.index_path
+    else:
+        csv_folder = os.path.join(export_path, "csv")
+        os.makedirs(csv_folder, exist_ok=True)
+
+        def save(image_id, colors):
+            csv_path = os.path.join(csv_folder, image_id+'.csv')
+            save_colors_to_csv(colors, csv_path)
+            return csv_path
+    return save
+
+
+def run_segmentation(model, input_path, export_path, manifest, color_backend="kmeans", in_memory_colors=True,
+                     save_seg_png=False, batch_size=8, num_workers=None, threshold=0.005, tile_size=None,
+                     tile_overlap=64, histogram_space=None, preview=None, colour_store=False):
+    """
+    Segments the new or changed photos of input_path, appends their mean
+    colours to mask_color_data.csv and, in memory mode, extracts their
+    dominant colours straight from the mask into csv/.
+
+    Parameter:
+    - model: A VegAnnModel with its weights loaded, or a compiled model from
+      load_compiled_model.
+    - input_path: The folder containing the original photos.
+    - export_path: The folder all outputs are written to.
+    - manifest: The PipelineManifest recording processed photos.
+    - color_backend: The dominant colour backend, see COLOR_BACKENDS.
+    - in_memory_colors: Extract colours from the in-memory mask when the
+      backend allows it, instead of through seg/ PNGs.
+    - save_seg_png: Also write the seg/ PNGs in memory mode.
+    - batch_size, num_workers, tile_size, tile_overlap: Passed to segment_folder.
+    - threshold: The pixel fraction threshold of the colour extraction.
+    - histogram_space: If given ("RGB" or "Lab"), the vegetation pixels are
+      also folded into the ColourHistogram at histogram_path(export_path),
+      which is resumed across runs and saved together with the manifest.
+      The manifest records the photos counted as its own "histogram" stage,
+      so photos segmented before are segmented once more to be added. When
+      a counted photo changed or was removed, the histogram is rebuilt from
+      every photo, see pending_photos.
+    - preview: Show the photo and its prediction side by side for every
+      photo; None shows them only when the matplotlib backend can display
+      them (see figures.can_show), so headless runs skip drawing altogether.
+    - colour_store: Append the dominant colours to the ColourStore at
+      colour_store_path(export_path) instead of writing one CSV per photo.
+
+    Returns:
+    - The number of photos segmented.
+    """
+    from matplotlib.image import imsave
+
+    from .segmentation import segment_folder
+
+    if preview is None:
+        preview = can_show()
+
+    in_memory = uses_in_memory_colors(in_memory_colors, color_backend)
+    seg_folder = os.path.join(export_path, "seg")
+    save_colors = _colour_saver(export_path, colour_store) if in_memory else None
+
+    histogram = None
+    hist_path = histogram_path(export_path) if histogram_space is not None else None
+    if histogram_space is not None:
+        if os.path.exists(hist_path):
+            histogram = ColourHistogram.load(hist_path)
+            if histogram.space != histogram_space:
+                raise ValueError(f"{hist_path} is a {histogram.space} histogram, not {histogram_space}")
+        else:
+            histogram = ColourHistogram(space=histogram_space)
+        manifest.on_save(lambda: histogram.save(hist_path))
+
+    def save_segmentation(filename, im, pred):
+        if histogram is not None:
+            with span("histogram", filename):
+                histogram.add(im, mask=pred)
+            manifest.record("histogram", input_path, filename, [hist_path])
+            if filename in histogram_only:
+                # 已分割过的照片只补充直方图，其余输出保持不变
+                return
+
+        with span("mask_colour", filename):
+            im2_pred = colorTransform_VegGround(im,pred,1,0,masked_only=True)
+
+            # 获取掩膜区域的平均RGB颜色，追加到 mask_color_data.csv
+            mask_color = np.mean(im2_pred, axis=(0, 1))
+            mask_color_writer.append(filename, mask_color)
+
+        if preview:
+            with span("preview", filename):
+                fig, (ax1, ax2) = new_figure(True, ncols=2)
+                ax1.imshow(im)
+                ax1.set_title("Input Image")
+
+                ax2.imshow(im2_pred)
+                ax2.set_title("Prediction")
+                show_figure(fig, True)
+
+        outputs = []
+        # 内存模式：掩膜和原图直接送去提取主色，只对植被像素取样
+        if in_memory:
+            with span("dominant_colours", filename):
+                colors = ARRAY_COLOR_BACKENDS[color_backend](im, threshold, mask=pred)
+                outputs.append(save_colors(filename+'.png', colors))
+
+        if save_seg_png or not in_memory:
+            with span("save_seg_png", filename):
+                os.makedirs(seg_folder, exist_ok=True)
+                seg_path = os.path.join(seg_folder, filename+'.png')
+                imsave(seg_path, im2_pred)
+            outputs.append(seg_path)
+
+        # 记录清单时要计算文件哈希，云盘上的读取时间也计入这里
+        with span("manifest", filename):
+            manifest.record("segment", input_path, filename, outputs)
+
+    def skip_photo(filename):
+        # 无法读取的文件（例如不是图片）记为没有输出的已处理文件，改动之前不再重试
+        for stage in ("segment", "histogram") if histogram is not None else ("segment",):
+            manifest.record(stage, input_path, filename, [])
+
+    # 已处理且未改动的照片会跳过
+    with manifest, MaskColorWriter(os.path.join(export_path, 'mask_color_data.csv'), resume=True) as mask_color_writer:
+        with span("manifest_scan"):
+            filenames, histogram_only, rebuild_histogram = pending_photos(manifest, input_path, hist_path)
+        if rebuild_histogram:
+            # 旧的像素无法从直方图中减去，从空的直方图重新统计所有照片
+            print(f"Photos counted in {hist_path} changed, rebuilding it")
+            histogram = ColourHistogram(space=histogram_space)
+            manifest.reset_stage("histogram")
+        count = segment_folder(model, input_path, save_segmentation, filenames=filenames,
+                               batch_size=batch_size, num_workers=num_workers, tile_size=tile_size,
+                               tile_overlap=tile_overlap, on_skip=skip_photo)
+    with span("excel_export"):
+        mask_color_writer.export_excel(os.path.join(export_path, 'mask_color_data.xlsx'))
+    return count
+
+
+def run_color_extraction(export_path, manifest, color_backend="kmeans", threshold=0.005, vision_concurrency=4,
+                         vision_client_factory=None, colour_store=False):
+    """
+    Extracts the dominant colours of the new or changed seg/ PNGs into csv/,
+    or the ColourStore with colour_store, for backends that need an image
+    file such as Google Vision.
+
+    The "vision" backend sends the images in concurrent batched requests
+    (see vision.annotate_image_properties); vision_concurrency bounds the
+    requests in flight and vision_client_factory can supply another client,
+    e.g. vision.FakeVisionClient.
+
+    Returns:
+    - The number of images processed.
+    """
+    seg_folder = os.path.join(export_path, "seg")
+    os.makedirs(seg_folder, exist_ok=True)
+    save_image_colors = _colour_saver(export_path, colour_store)
+
+    def save_colors(image_path, colors):
+        output = save_image_colors(os.path.basename(image_path), colors)
+        manifest.record("colors", seg_folder, os.path.basename(image_path), [output])
+
+    if color_backend == "vision":
+        from .vision import detect_image_properties_batch
+
+        with manifest:
+            image_paths = [os.path.join(seg_folder, filename) for filename in manifest.pending("colors", seg_folder)]
+            detect_image_properties_batch(image_paths, threshold, client_factory=vision_client_factory,
+                                          on_result=save_colors, max_concurrency=vision_concurrency)
+        return len(image_paths)
+
+    count = 0
+    with manifest:
+        for filename in manifest.pending("colors", seg_folder):
+            with span("dominant_colours", filename):
+                colors = detect_image_properties(os.path.join(seg_folder, filename), threshold, backend=color_backend)
+                output = save_image_colors(filename, colors)
+            with span("manifest", filename):
+                manifest.record("colors", seg_folder, filename, [output])
+            count += 1
+    return count
+
+
+def run_aggregation(export_path, base_name, spaces=("HSV",), palette_source="images", histogram_paths=None,
+                    palette_colors=30, colour_store=False, drop_dark=True):
+    """
+    Writes the season colour table the renderers read.
+
+    Parameter:
+    - export_path, base_name: As in run_pipeline.
+    - spaces: The colour spaces added to the table, see COLOUR_SPACES.
+    - palette_source: "images" concatenates the per-image dominant colours of
+      csv/; "histogram" derives the palette from the merged colour histogram,
+      so every photo counts by its number of vegetation pixels.
+    - histogram_paths: The histograms merged for "histogram"; defaults to the
+      one of export_path. Pass the histograms of other folders to combine
+      folders processed in parallel.
+    - palette_colors: The number of colours of a histogram palette.
+    - colour_store: Read the per-image colours from the memory-mapped
+      ColourStore instead of the csv/ files.
+    - drop_dark: Drop the dark colours of every image, i.e. the black
+      background of the seg/ PNGs; pass False when the colours were extracted
+      in memory from the vegetation pixels only (see uses_in_memory_colors).
+
+    Returns:
+    - The path of the table.
+    """
+    output_filename = hsv_table_path(export_path, base_name)
+    os.makedirs(os.path.dirname(output_filename), exist_ok=True)
+    if palette_source == "histogram":
+        histogram_paths = histogram_paths or [histogram_path(export_path)]
+        missing = [path for path in histogram_paths if not os.path.exists(path)]
+        if missing:
+            raise FileNotFoundError(f"colour histogram(s) not found: {', '.join(missing)}; "
+                                    "run the segment stage with histogram_space first")
+        histogram = ColourHistogram.merge_files(histogram_paths)
+        if histogram.total == 0:
+            raise ValueError(f"the colour histogram of {', '.join(histogram_paths)} is empty, "
+                             "no vegetation pixels were counted")
+        # 直方图只统计了植被像素，暗色是阴影中的叶片，不删除
+        histogram_palette_table(histogram, base_name, palette_colors, spaces,
+                                drop_dark=False).to_csv(output_filename, index=False)
+        print(f'Processed file saved as {output_filename}')
+        return output_filename
+
+    combined_filename = os.path.join(export_path, 'combined_'+base_name+'.csv')
+    if colour_store:
+        # 直接从内存映射的记录生成两个表格，不再逐个解析 CSV 文件
+        df = ColourStore(colour_store_path(export_path)).table(spaces, drop_dark)
+        if df.empty:
+            # 与 aggregate_color_tables 相同，覆盖上次运行的表格
+            write_empty_color_tables(combined_filename, output_filename, spaces)
+            print(f'No colours to aggregate in {colour_store_path(export_path)}, wrote empty tables')
+            return output_filename
+        df[COMBINED_COLUMNS].to_csv(combined_filename, index=False)
+        df.to_csv(output_filename, index=False)
+        print(f'Combined CSV saved as {combined_filename}')
+        print(f'Processed file saved as {output_filename}')
+        return output_filename
+
+    # 一次遍历 csv/ 中的表格，同时写出 combined 表格和 HSV 表格
+    aggregate_color_tables(os.path.join(export_path, "csv"), combined_filename, output_filename, spaces=spaces,
+                           drop_dark=drop_dark)
+    return output_filename
+
+
+def run_render(export_path, base_name, seed=0, cache_dir=None, show=None, floral_size=1024, vector_formats=(),
+               print_dpis=(), print_width_mm=None, colour_store=False):
+    """
+    Renders the Voronoi and floral bookmarks of the season table, reusing
+    cached renders when the table, seed and parameters are unchanged, and
+    tiles the per-image colour strips into palettes_<base_name>.png.
+
+    Parameter:
+    - export_path, base_name, seed, cache_dir: As in run_pipeline.
+    - show: Display the floral pattern, see generate_floral_pattern.
+    - floral_size: The longer side of the floral PNG in pixels.
+    - vector_formats: Also write both bookmarks in these formats of
+      vector.VECTOR_FORMATS, e.g. ("svg", "pdf").
+    - print_dpis: Also rasterize both bookmarks at these resolutions from
+      the same geometry, e.g. (300, 600).
+    - print_width_mm: The printed width of the vector and print exports.
+    - colour_store: Take the per-image colour strips from the ColourStore
+      instead of csv/.
+
+    Returns:
+    - The paths of the images written.
+    """
+    csv_file_path = hsv_table_path(export_path, base_name)
+    output_folder = os.path.dirname(csv_file_path)
+    if pd.read_csv(csv_file_path, usecols=['Ratio']).empty:
+        raise ValueError(f"{csv_file_path} has no colours to render; check the segment and aggregate stages")
+    if cache_dir is None:
+        cache_dir = os.path.join(export_path, ".render_cache")
+    output_image_path1 = os.path.join(output_folder, 'vrinoi_'+base_name+'.png')
+    output_image_path2 = os.path.join(output_folder, 'floral_pattern_'+base_name+'.png')
+
+    with span("render_voronoi"):
+        render_cached(generate_colored_voronoi_raster, csv_file_path, output_image_path1, cache_dir, seed=seed)
+    with span("render_floral"):
+        render_cached(generate_floral_pattern, csv_file_path, output_image_path2, cache_dir, show=show,
+                      size=floral_size)
+    outputs = [output_image_path1, output_image_path2]
+
+    if vector_formats or print_dpis:
+        from .vector import export_bookmark, floral_geometry, voronoi_geometry
+
+        # 每种图案只计算一次几何形状，再写出各种格式和分辨率
+        with span("render_vector"):
+            outputs += export_bookmark(voronoi_geometry(csv_file_path, seed=seed),
+                                       os.path.join(output_folder, 'vrinoi_'+base_name), vector_formats, print_dpis,
+                                       print_width_mm)
+            outputs += export_bookmark(floral_geometry(csv_file_path, size=floral_size),
+                                       os.path.join(output_folder, 'floral_pattern_'+base_name), vector_formats,
+                                       print_dpis, print_width_mm)
+
+    palette_source = colour_store_path(export_path) if colour_store else os.path.join(export_path, "csv")
+    if os.path.isdir(palette_source):
+        output_image_path3 = os.path.join(output_folder, 'palettes_'+base_name+'.png')
+        with span("render_palettes"):
+            if colour_store:
+                palette_source = ColourStore(palette_source)
+            if generate_palette_contact_sheet(palette_source, output_image_path3):
+                outputs.append(output_image_path3)
+    return outputs
+
+
+def run_pipeline(input_path, export_path, base_name, stages=STAGES, checkpoint=None, model=None,
+                 color_backend="kmeans", in_memory_colors=True, save_seg_png=False, batch_size=8,
+                 num_workers=None, spaces=("HSV",), seed=0, cache_dir=None, inference_mode="fp32",
+                 calibration_path=None, tile_size=None, tile_overlap=64, histogram_space=None,
+                 palette_source="images", histogram_paths=None, palette_colors=30, profile=True, trace=False,
+                 preview=False, vector_formats=(), print_dpis=(), print_width_mm=None, colour_store=False,
+                 model_loader=None):
+    """
+    Runs the selected stages of the bookmark pipeline for one photo folder.
+
+    Parameter:
+    - input_path: The folder containing the original photos.
+    - export_path: The folder all outputs are written to.
+    - base_name: The name used for the combined table and the bookmarks.
+    - stages: The stages to run, a subset of STAGES.
+    - checkpoint: The VegAnn checkpoint, loaded when segmenting without a model.
+    - model: An already loaded VegAnnModel or compiled model.
+    - model_loader: Called without arguments to get the model when model is
+      None, e.g. to reuse a per-process model; defaults to loading checkpoint.
+      Neither the loader nor the checkpoint is used when no photo is pending.
+    - inference_mode: One of inference_modes.INFERENCE_MODES, used when
+      loading the checkpoint; "int8" also needs calibration_path.
+    - palette_source: "images" or "histogram", see run_aggregation; a
+      histogram palette collects a Lab histogram unless histogram_space is set.
+    - profile: Record the time and memory of every stage and image into
+      export_path/profile/ (see profiling.Profiler); runs of only some
+      stages write to profile/<stages>/, e.g. profile/segment/, so the
+      runs of the batch scheduler keep each other's reports.
+    - trace: Also write a Chrome trace, profile_trace.json.
+    - preview: Show a preview figure per segmented photo, see run_segmentation;
+      off by default so batch runs never draw or keep figures.
+    - colour_store: Keep the per-image colours in one memory-mapped
+      ColourStore instead of one CSV file per image.
+    - The remaining parameters are passed to the stage functions.
+
+    Returns:
+    - A dict with the result of every stage run: the number of photos
+      segmented or coloured, the table path, the rendered image paths.
+    """
+    os.makedirs(export_path, exist_ok=True)
+    if palette_source == "histogram" and histogram_space is None:
+        histogram_space = "Lab"
+    manifest = PipelineManifest(os.path.join(export_path, "manifest.json"))
+    results = {}
+    profile_folder = profile_path(export_path, stages)
+
+    with profile_run(profile_folder, trace) if profile else nullcontext():
+        if "segment" in stages:
+            with manifest, span("manifest_scan"):
+                pending = pending_photos(manifest, input_path,
+                                         histogram_path(export_path) if histogram_space else None)[0]
+        if "segment" in stages and not pending:
+            # 所有照片都已分割，不必加载模型
+            results["segment"] = 0
+        elif "segment" in stages:
+            with span("load_model"):
+                if model is None and model_loader is not None:
+                    model = model_loader()
+                elif model is None and inference_mode == "fp32":
+                    from .model import get_shared_model
+
+                    # 使用缓存的 TorchScript 模型，同一进程内只加载一次
+                    model = get_shared_model(checkpoint)
+                elif model is None:
+                    from .inference import optimize_for_inference
+                    from .model import load_model
+
+                    model = optimize_for_inference(load_model(checkpoint), inference_mode,
+                                                   calibration_path=calibration_path)
+            with span("stage:segment"):
+                results["segment"] = run_segmentation(
+                    model, input_path, export_path, manifest, color_backend=color_backend,
+                    in_memory_colors=in_memory_colors, save_seg_png=save_seg_png, batch_size=batch_size,
+                    num_workers=num_workers, tile_size=tile_size, tile_overlap=tile_overlap,
+                    histogram_space=histogram_space, preview=preview, colour_store=colour_store)
+        if "colors" in stages and not uses_in_memory_colors(in_memory_colors, color_backend):
+            with span("stage:colors"):
+                results["colors"] = run_color_extraction(export_path, manifest, color_backend=color_backend,
+                                                         colour_store=colour_store)
+        if "aggregate" in stages:
+            with span("stage:aggregate"):
+                results["aggregate"] = run_aggregation(export_path, base_name, spaces=spaces,
+                                                       palette_source=palette_source,
+                                                       histogram_paths=histogram_paths, palette_colors=palette_colors,
+                                                       colour_store=colour_store,
+                                                       drop_dark=not uses_in_memory_colors(in_memory_colors,
+                                                                                           color_backend))
+        if "render" in stages:
+            with span("stage:render"):
+                results["render"] = run_render(export_path, base_name, seed=seed, cache_dir=cache_dir, show=preview,
+                                               vector_formats=vector_formats, print_dpis=print_dpis,
+                                               print_width_mm=print_width_mm, colour_store=colour_store)
+    return results
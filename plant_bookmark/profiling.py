@@ -0,0 +1,199 @@
+"""Per-stage and per-image timing and memory instrumentation."""
+
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+# macOS 的 ru_maxrss 单位是字节，Linux 是 KB
+_MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def current_rss():
+    # 当前常驻内存（字节），只在 Linux 上可读
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss():
+    # 进程启动以来的最高常驻内存（字节）
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_UNIT
+
+
+def _mb(n_bytes):
+    return None if n_bytes is None else round(n_bytes / 2 ** 20, 1)
+
+
+class Profiler:
+    """
+    Records wall time, CPU time, resident memory and item counts of named
+    spans. Totals are kept per stage; the spans of single images (item set)
+    are streamed to a CSV file and, optionally, all spans to a Chrome trace
+    (open it in chrome://tracing or ui.perfetto.dev), so memory use stays
+    constant however many images are processed.
+
+    A span costs 10-50 microseconds, a handful per photo, against the
+    hundreds of milliseconds of decoding and segmenting it, so the profiler
+    can stay on in production runs.
+
+    CPU time is the process CPU time during the span, so it includes the
+    torch threads of a forward pass but also any other thread running at the
+    same time. peak_rss_mb is the process high-water mark when the stage last
+    ended and rss_growth_mb how much the stage raised it.
+
+    Parameter:
+    - output_folder: The folder profile_summary.{json,csv}, profile_items.csv
+      and profile_trace.json are written to; None keeps the totals in memory.
+    - trace: Also write the Chrome trace.
+    """
+    summary_columns = ['stage', 'calls', 'items', 'wall_s', 'cpu_s', 'mean_wall_ms', 'peak_rss_mb', 'rss_growth_mb']
+    item_columns = ['stage', 'item', 'start_s', 'wall_ms', 'cpu_ms', 'rss_mb', 'peak_rss_mb']
+
+    def __init__(self, output_folder=None, trace=False):
+        self.output_folder = output_folder
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._items_file = self._trace_file = None
+        if output_folder is not None:
+            os.makedirs(output_folder, exist_ok=True)
+            self._items_file = open(os.path.join(output_folder, 'profile_items.csv'), 'w', newline='',
+                                    encoding='utf-8')
+            self._items_writer = csv.writer(self._items_file)
+            self._items_writer.writerow(self.item_columns)
+            if trace:
+                # Chrome 的 JSON 数组格式允许逐条追加事件
+                self._trace_file = open(os.path.join(output_folder, 'profile_trace.json'), 'w', encoding='utf-8')
+                self._trace_file.write('[\n')
+
+    @contextmanager
+    def span(self, stage, item=None, count=1):
+        start, cpu_start, peak_start = time.perf_counter(), time.process_time(), peak_rss()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+            self._record(stage, item, count, start, wall, cpu, peak_start)
+
+    def _record(self, stage, item, count, start, wall, cpu, peak_start):
+        peak = peak_rss()
+        rss = current_rss() if item is not None or self._trace_file is not None else None
+        with self._lock:
+            stat = self.stats.setdefault(stage, {'calls': 0, 'items': 0, 'wall_s': 0.0, 'cpu_s': 0.0,
+                                                 'peak_rss': 0, 'rss_growth': 0})
+            stat['calls'] += 1
+            stat['items'] += count
+            stat['wall_s'] += wall
+            stat['cpu_s'] += cpu
+            if peak is not None:
+                stat['peak_rss'] = max(stat['peak_rss'], peak)
+                stat['rss_growth'] += peak - peak_start
+            if item is not None and self._items_file is not None:
+                self._items_writer.writerow([stage, item, round(start - self._start, 6), round(wall * 1000, 3),
+                                             round(cpu * 1000, 3), _mb(rss), _mb(peak)])
+            if self._trace_file is not None:
+                event = {'name': stage, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                         'ts': round((start - self._start) * 1e6), 'dur': round(wall * 1e6),
+                         'args': {'item': item, 'count': count, 'cpu_ms': round(cpu * 1000, 3), 'rss_mb': _mb(rss)}}
+                self._trace_file.write(json.dumps(event, ensure_ascii=False) + ',\n')
+
+    def summary(self):
+        rows = [{
+            'stage': stage,
+            'calls': stat['calls'],
+            'items': stat['items'],
+            'wall_s': round(stat['wall_s'], 3),
+            'cpu_s': round(stat['cpu_s'], 3),
+            'mean_wall_ms': round(stat['wall_s'] / stat['calls'] * 1000, 3),
+            'peak_rss_mb': _mb(stat['peak_rss']),
+            'rss_growth_mb': _mb(stat['rss_growth']),
+        } for stage, stat in self.stats.items()]
+        return pd.DataFrame(rows, columns=self.summary_columns)
+
+    def close(self):
+        summary = self.summary()
+        if self.output_folder is not None:
+            summary.to_csv(os.path.join(self.output_folder, 'profile_summary.csv'), index=False)
+            with open(os.path.join(self.output_folder, 'profile_summary.json'), 'w', encoding='utf-8') as f:
+                json.dump(summary.to_dict(orient='records'), f, ensure_ascii=False, indent=1)
+        if self._items_file is not None and not self._items_file.closed:
+            self._items_file.close()
+        if self._trace_file is not None and not self._trace_file.closed:
+            self._trace_file.write('{}]\n')
+            self._trace_file.close()
+        return summary
+
+
+_active = None
+
+
+def span(stage, item=None, count=1):
+    """
+    Times a block as a span of stage in the active profiler; a no-op when no
+    profiler is active (see profile_run).
+
+    Parameter:
+    - stage: The stage name, e.g. "decode" or "forward".
+    - item: The image the span belongs to, for the per-image report.
+    - count: The number of items the span processed, e.g. a batch size.
+    """
+    if _active is None:
+        return nullcontext()
+    return _active.span(stage, item, count)
+
+
+def start_profiling(output_folder=None, trace=False):
+    """
+    Activates a new Profiler, for notebooks where the stages run in separate
+    cells; stop_profiling writes its report. Returns the active profiler,
+    which is the existing one if profiling is already on.
+    """
+    global _active
+    if _active is None:
+        _active = Profiler(output_folder, trace)
+    return _active
+
+
+def stop_profiling():
+    # 写出报告并打印各阶段汇总
+    global _active
+    profiler, _active = _active, None
+    if profiler is None:
+        return None
+    summary = profiler.close()
+    if not summary.empty:
+        print(summary.to_string(index=False))
+    return summary
+
+
+@contextmanager
+def profile_run(output_folder=None, trace=False):
+    """
+    Profiles the block and writes the report at the end. If a profiler is
+    already active it is reused, so nested runs (e.g. run_pipeline inside a
+    larger script) report into the outer one.
+    """
+    if _active is not None:
+        yield _active
+        return
+    profiler = start_profiling(output_folder, trace)
+    try:
+        yield profiler
+    finally:
+        stop_profiling()
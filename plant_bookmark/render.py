@@ -0,0 +1,514 @@
+"""Voronoi and floral bookmark renderers."""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from .figures import can_show, new_figure, show_figure
+
+# 渲染缓存键的一部分；渲染器的输出有变化时加一，旧的缓存图像不再被使用
+RENDER_CACHE_VERSION = 2
+
+
+# 读取颜色数据
+def read_color_data(csv_file_path):
+    color_data = pd.read_csv(csv_file_path)
+    return color_data[['r', 'g', 'b']].values, color_data['Ratio'].values
+
+
+# 生成并填色泰森多边形，确保角落区域也着色
+def generate_colored_voronoi(csv_file_path, output_image_path, width=1024, height=768, seed=None, show=None):
+    # 种子点和颜色与栅格、矢量版本共用 voronoi_seeds，同一种子得到相同的图案
+    points, vor, point_colors = voronoi_seeds(csv_file_path, width, height, seed)
+
+    # 绘制并填色；show 为 None 时只在能显示图像的后端（如 notebook）中显示
+    show = can_show() if show is None else show
+    fig, ax = new_figure(show, figsize=(width / 100, height / 100), dpi=100)
+    ax.axis('off')
+    for point, region_index in enumerate(vor.point_region):
+        region = vor.regions[region_index]
+        if not -1 in region and len(region) > 0:
+            polygon = [vor.vertices[i] for i in region]
+            ax.fill(*zip(*polygon), color=point_colors[point] / 255)
+
+    ax.set_xlim(0, width)
+    ax.set_ylim(0, height)
+    ax.invert_yaxis()
+    ax.axis('off')
+    fig.savefig(output_image_path, bbox_inches='tight', pad_inches=0)
+    show_figure(fig, show)
+
+
+def nearest_seed_labels(tree, out_width, out_height, scale=1.0, block=8, chunk_pixels=1 << 20):
+    """
+    Labels every pixel of an out_height x out_width image with the index of the
+    nearest point in tree, where pixel centres map to ((x + 0.5) / scale,
+    (y + 0.5) / scale).
+
+    The tree is first queried on a lattice every `block` pixels. Voronoi cells
+    are convex, so a block whose four corners share a label lies entirely in
+    that cell; only the pixels of mixed blocks are queried individually.
+    Pixels are processed in bands of about chunk_pixels to bound memory.
+    """
+    def query(ys, xs):
+        grid = np.stack([(xs + 0.5) / scale, (ys + 0.5) / scale], axis=-1)
+        return tree.query(grid, workers=-1)[1].astype(np.int32)
+
+    lattice_y = np.unique(np.append(np.arange(0, out_height, block), out_height - 1))
+    lattice_x = np.unique(np.append(np.arange(0, out_width, block), out_width - 1))
+    labels = np.empty((out_height, out_width), dtype=np.int32)
+    if len(lattice_y) < 2 or len(lattice_x) < 2:
+        ys, xs = np.mgrid[0:out_height, 0:out_width]
+        labels[...] = query(ys.ravel(), xs.ravel()).reshape(out_height, out_width)
+        return labels
+
+    corners = query(*[g.ravel() for g in np.meshgrid(lattice_y, lattice_x, indexing='ij')]).reshape(len(lattice_y), len(lattice_x))
+    uniform = ((corners[:-1, :-1] == corners[:-1, 1:]) & (corners[:-1, :-1] == corners[1:, :-1])
+               & (corners[:-1, :-1] == corners[1:, 1:]))
+    block_labels = np.where(uniform, corners[:-1, :-1], -1)
+
+    # 每列方块覆盖的像素列数（最后一块包含末列），用于把方块标签展开到像素
+    block_widths = np.diff(lattice_x)
+    block_widths[-1] += 1
+    rows_per_chunk = max(1, chunk_pixels // out_width)
+    for top in range(0, out_height, rows_per_chunk):
+        rows = np.arange(top, min(top + rows_per_chunk, out_height))
+        block_y = np.minimum(np.searchsorted(lattice_y, rows, side='right') - 1, len(lattice_y) - 2)
+        band = np.repeat(block_labels[block_y], block_widths, axis=1)
+        mixed_y, mixed_x = np.nonzero(band < 0)
+        if len(mixed_y):
+            band[mixed_y, mixed_x] = query(mixed_y + top, mixed_x)
+        labels[top:top + len(rows)] = band
+    return labels
+
+
+def voronoi_seeds(csv_file_path, width=1024, height=768, seed=None):
+    """
+    Draws the seed points of the coloured Voronoi pattern and the colour of
+    every cell, shared by the matplotlib, raster and vector renderers so they
+    draw the same pattern for the same seed.
+
+    Returns:
+    - The (N, 2) seed points including the boundary points, their
+      scipy.spatial.Voronoi diagram, and the (N, 3) uint8 cell colours;
+      unbounded cells stay white like the background.
+    """
+    from scipy.spatial import Voronoi
+
+    colors, ratios = read_color_data(csv_file_path)
+    color_probabilities = ratios / np.sum(ratios)
+    rng = np.random.default_rng(seed)
+
+    # 生成种子点
+    seed_points = rng.random((len(colors) * 10, 2)) * [width, height]
+
+    # 在边界外添加一圈点以覆盖整个边界，确保包括角落在内的每个区域都被涂色
+    border_padding = 100  # 边界外扩展的距离
+    boundary_points = np.array([
+        [x, y]
+        for x in np.linspace(-border_padding, width + border_padding, num=4)
+        for y in np.linspace(-border_padding, height + border_padding, num=4)
+    ])
+    points = np.vstack([seed_points, boundary_points])
+    vor = Voronoi(points)
+
+    # 与 matplotlib 版本一致：只有有限区域填色，无限区域保持白色背景
+    finite = np.array([not -1 in vor.regions[r] and len(vor.regions[r]) > 0 for r in vor.point_region])
+    point_colors = np.full((len(points), 3), 255, dtype=np.uint8)
+    point_colors[finite] = colors[rng.choice(len(colors), size=finite.sum(), p=color_probabilities)]
+    return points, vor, point_colors
+
+
+# 栅格版泰森多边形：每个像素直接取最近种子点的颜色，不再逐个区域调用 plt.fill
+def generate_colored_voronoi_raster(csv_file_path, output_image_path, width=1024, height=768, scale=1.0, seed=None, chunk_pixels=1 << 20):
+    """
+    Renders the same coloured Voronoi pattern as generate_colored_voronoi, but
+    assigns every output pixel to its nearest seed point with a KD-tree and
+    writes the image array straight to PNG.
+
+    Parameter:
+    - csv_file_path: The combined colour table with 'r', 'g', 'b' and 'Ratio'.
+    - output_image_path: The PNG file to write.
+    - width, height: The size of the pattern, in the same units as
+      generate_colored_voronoi.
+    - scale: Output pixels per unit, e.g. 4 for a poster-size export of the
+      same layout.
+    - seed: Seed for the seed points and colours; the same seed and colour
+      table always give the same pattern.
+    - chunk_pixels: The number of pixels looked up at once, bounding memory.
+    """
+    from scipy.spatial import cKDTree
+
+    points, _, point_colors = voronoi_seeds(csv_file_path, width, height, seed)
+
+    tree = cKDTree(points)
+    out_width, out_height = int(round(width * scale)), int(round(height * scale))
+    labels = nearest_seed_labels(tree, out_width, out_height, scale, chunk_pixels=chunk_pixels)
+    image = np.take(point_colors, labels, axis=0)
+
+    Image.fromarray(image).save(output_image_path)
+
+
+def floral_layout(radii, start_gap=5.0, step=10.0, step_growth=1.02, spacing=0.8):
+    """
+    Places the circles of the floral pattern along its spiral: the smallest
+    circle in the centre and the others, from small to large, at a growing
+    distance and angle. The whole spiral is computed with cumulative sums
+    instead of one circle at a time.
+
+    Parameter:
+    - radii: The circle radii.
+    - start_gap: The gap between the centre circle and the first ring.
+    - step, step_growth: The arc length between consecutive circles starts
+      at step and is multiplied by step_growth after every circle.
+    - spacing: The distance to the centre grows by spacing times the radius
+      of every circle placed.
+
+    Returns:
+    - The (N, 2) circle centres and radii in drawing order, and the indices
+      of that order into radii.
+    """
+    radii = np.asarray(radii, dtype=np.float64)
+    order = np.argsort(radii)
+    sorted_radii = radii[order]
+    n = len(sorted_radii)
+    centers = np.zeros((n, 2))
+    if n < 2:
+        return centers, sorted_radii, order
+
+    # 第 i 个圆到中心的距离：第一圈为 r0 + r1 + start_gap，之后每放一个圆增加 spacing * r
+    distances = sorted_radii[0] + sorted_radii[1] + start_gap + spacing * np.concatenate(
+        [[0.0], np.cumsum(sorted_radii[1:-1])])
+    # 角度从 π/4 开始，每次增加 step / 距离，step 每次乘以 step_growth
+    steps = step * step_growth ** np.arange(n - 2)
+    theta = np.pi / 4 + np.concatenate([[0.0], np.cumsum(steps / distances[:-1])])
+    centers[1:] = np.column_stack([np.cos(theta), np.sin(theta)]) * distances[:, None]
+    return centers, sorted_radii, order
+
+
+def _grid_pairs(centers, cell):
+    # 每个圆只与相邻 3x3 格子中的圆组成候选对
+    n = len(centers)
+    cells = np.floor((centers - centers.min(axis=0)) / cell).astype(np.int64) + 1
+    n_rows = cells[:, 1].max() + 2
+    keys = cells[:, 0] * n_rows + cells[:, 1]
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    first, second = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            neighbour_keys = keys + dx * n_rows + dy
+            lo = np.searchsorted(sorted_keys, neighbour_keys, side="left")
+            counts = np.searchsorted(sorted_keys, neighbour_keys, side="right") - lo
+            i = np.repeat(np.arange(n), counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            j = order[np.repeat(lo, counts) + offsets]
+            keep = i < j
+            first.append(i[keep])
+            second.append(j[keep])
+    return np.concatenate(first), np.concatenate(second)
+
+
+def _overlapping_pairs(centers, radii, gap):
+    # 格子边长按 99% 分位的半径取，少数特别大的圆与所有圆直接比较，避免一个大圆让格子过大
+    n = len(centers)
+    cell = 2 * np.percentile(radii, 99) + gap
+    is_large = 2 * radii + gap > cell
+    small = np.flatnonzero(~is_large)
+    i, j = _grid_pairs(centers[small], cell)
+    i, j = small[i], small[j]
+    large = np.flatnonzero(is_large)
+    if len(large):
+        large_i, others = np.repeat(large, n), np.tile(np.arange(n), len(large))
+        # 大圆之间的对只算一次
+        keep = ~is_large[others] | (others > large_i)
+        i, j = np.concatenate([i, large_i[keep]]), np.concatenate([j, others[keep]])
+
+    delta = centers[j] - centers[i]
+    distance = np.hypot(delta[:, 0], delta[:, 1])
+    overlap = radii[i] + radii[j] + gap - distance
+    hit = overlap > 1e-9
+    return i[hit], j[hit], delta[hit], distance[hit], overlap[hit]
+
+
+def resolve_overlaps(centers, radii, gap=0.0, n_iter=100, seed=0):
+    """
+    Pushes overlapping circles apart until no two overlap or n_iter rounds
+    have passed. Candidate pairs come from a uniform spatial grid sized by
+    the 99th percentile radius, so a round costs about O(N) instead of
+    O(N²); the few larger circles are compared with every circle.
+
+    Every overlapping pair is moved apart along the line between its centres,
+    the smaller circle further than the larger one.
+
+    Parameter:
+    - centers: The (N, 2) circle centres, e.g. from floral_layout.
+    - radii: The circle radii.
+    - gap: The minimum distance between circle edges.
+    - n_iter: The maximum number of rounds.
+    - seed: Seed for the direction of circles with identical centres.
+
+    Returns:
+    - The new (N, 2) centres.
+    """
+    centers = np.array(centers, dtype=np.float64)
+    radii = np.asarray(radii, dtype=np.float64)
+    if len(centers) < 2:
+        return centers
+    rng = np.random.default_rng(seed)
+    for _ in range(n_iter):
+        i, j, delta, distance, overlap = _overlapping_pairs(centers, radii, gap)
+        if len(i) == 0:
+            break
+        # 圆心重合时随机取一个方向
+        same = distance < 1e-12
+        angles = rng.uniform(0, 2 * np.pi, same.sum())
+        delta[same] = np.column_stack([np.cos(angles), np.sin(angles)])
+        distance[same] = 1.0
+        direction = delta / distance[:, None]
+        # 按面积分配位移，大圆移动得少
+        area_i, area_j = radii[i] ** 2, radii[j] ** 2
+        share_i = area_j / (area_i + area_j)
+        move = np.zeros_like(centers)
+        np.add.at(move, i, -direction * (overlap * share_i)[:, None])
+        np.add.at(move, j, direction * (overlap * (1 - share_i))[:, None])
+        centers += move
+    return centers
+
+
+def rasterize_discs(centers, radii, colors, extent, width, height, background=(255, 255, 255)):
+    """
+    Draws filled, anti-aliased discs straight into an RGB image, later discs
+    on top. Every disc only touches the pixels of its bounding box, and the
+    edge pixels are blended by how far they lie inside the circle.
+
+    Parameter:
+    - centers, radii: The discs in layout units, y pointing up.
+    - colors: The (N, 3) 0-255 disc colours.
+    - extent: The (xmin, xmax, ymin, ymax) layout area mapped onto the image.
+    - width, height: The image size in pixels.
+    - background: The colour of the uncovered pixels.
+
+    Returns:
+    - The (height, width, 3) uint8 image.
+    """
+    xmin, xmax, ymin, ymax = extent
+    scale_x, scale_y = width / (xmax - xmin), height / (ymax - ymin)
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:] = background
+    pixel_x = (np.asarray(centers)[:, 0] - xmin) * scale_x
+    pixel_y = (ymax - np.asarray(centers)[:, 1]) * scale_y
+    pixel_r = np.asarray(radii) * scale_x
+    colors = np.asarray(colors, dtype=np.float32)
+
+    for cx, cy, r, color in zip(pixel_x, pixel_y, pixel_r, colors):
+        x0, x1 = max(int(np.floor(cx - r - 1)), 0), min(int(np.ceil(cx + r + 1)), width)
+        y0, y1 = max(int(np.floor(cy - r - 1)), 0), min(int(np.ceil(cy + r + 1)), height)
+        if x0 >= x1 or y0 >= y1:
+            continue
+        # 像素中心到圆心的距离；边缘一个像素宽的过渡带做抗锯齿
+        dx = np.arange(x0, x1, dtype=np.float32) + 0.5 - cx
+        dy = np.arange(y0, y1, dtype=np.float32) + 0.5 - cy
+        coverage = np.clip(r + 0.5 - np.sqrt(dx[None, :] ** 2 + dy[:, None] ** 2), 0, 1)[..., None]
+        patch = image[y0:y1, x0:x1].astype(np.float32)
+        image[y0:y1, x0:x1] = np.rint(patch + (color - patch) * coverage).astype(np.uint8)
+    return image
+
+
+def floral_extent(centers, radii, margin=0.02):
+    # 自动取所有圆的外接矩形，四周留 margin 比例的空白
+    if len(centers) == 0:
+        return -1.0, 1.0, -1.0, 1.0
+    lo = (np.asarray(centers) - np.asarray(radii)[:, None]).min(axis=0)
+    hi = (np.asarray(centers) + np.asarray(radii)[:, None]).max(axis=0)
+    pad = (hi - lo).max() * margin
+    return lo[0] - pad, hi[0] + pad, lo[1] - pad, hi[1] + pad
+
+
+def floral_circles(csv_file_path, resolve=False, gap=0.0):
+    """
+    Computes the circles of the floral pattern, shared by the raster and
+    vector renderers.
+
+    Returns:
+    - The (N, 2) centres (y pointing up), radii and (N, 3) colours of the
+      circles in drawing order.
+    """
+    # 读取颜色和比例
+    color_data = pd.read_csv(csv_file_path)
+    colors = color_data[['r', 'g', 'b']].values
+    ratios = color_data['Ratio'].values
+
+    # 计算圆的半径，假设最大比例的圆半径为80，其他按比例计算
+    radii = np.sqrt(ratios / np.pi) * 35  # 减小基础半径使得排列更紧凑
+
+    # 沿螺旋线排列，最小的圆在中心
+    centers, sorted_radii, order = floral_layout(radii)
+    if resolve:
+        centers = resolve_overlaps(centers, sorted_radii, gap=gap)
+    return centers, sorted_radii, colors[order]
+
+
+def generate_floral_pattern(csv_file_path, output_image_path, show=None, size=1024, extent=None, resolve=False,
+                            gap=0.0):
+    """
+    Draws one circle per colour of the table, with an area proportional to
+    its ratio, along a spiral (see floral_layout), and rasterizes the discs
+    straight into a PNG.
+
+    Parameter:
+    - csv_file_path: The combined colour table with 'r', 'g', 'b' and 'Ratio'.
+    - output_image_path: The PNG file to write.
+    - show: Also display the image; None displays it only when the
+      matplotlib backend can (see figures.can_show).
+    - size: The longer side of the image in pixels, e.g. 4096 for print.
+    - extent: None fits the image to the circles; a number shows the square
+      from -extent to extent, e.g. 250 for the fixed limits used before.
+    - resolve: Push overlapping circles apart (see resolve_overlaps).
+    - gap: The minimum distance between circle edges when resolving.
+    """
+    centers, radii, colors = floral_circles(csv_file_path, resolve, gap)
+    if extent is None:
+        extent = floral_extent(centers, radii)
+    else:
+        extent = (-extent, extent, -extent, extent)
+    aspect = (extent[1] - extent[0]) / (extent[3] - extent[2])
+    width, height = (size, max(1, int(round(size / aspect)))) if aspect >= 1 else (max(1, int(round(size * aspect))), size)
+    image = rasterize_discs(centers, radii, colors, extent, width, height)
+    Image.fromarray(image).save(output_image_path)
+
+    show = can_show() if show is None else show
+    if show:
+        fig, ax = new_figure(True)
+        ax.imshow(image)
+        ax.axis('off')
+        show_figure(fig, True)
+
+
+# 带中文字形的常见字体（Colab/Ubuntu 的 fonts-noto-cjk、fonts-wqy，Windows、macOS 自带）
+CJK_LABEL_FONTS = ("NotoSansCJK-Regular.ttc", "NotoSansCJKsc-Regular.otf", "wqy-microhei.ttc", "wqy-zenhei.ttc",
+                   "msyh.ttc", "simhei.ttf", "PingFang.ttc", "Hiragino Sans GB.ttc")
+
+
+def _label_font(size=10):
+    # 返回字体，以及它能否显示中文；找不到中文字体时用 Pillow 的默认字体
+    from PIL import ImageFont
+
+    for name in CJK_LABEL_FONTS:
+        try:
+            return ImageFont.truetype(name, size), True
+        except OSError:
+            continue
+    return ImageFont.load_default(), False
+
+
+def _latin1(text):
+    try:
+        text.encode('latin-1')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def generate_palette_contact_sheet(source, output_image_path, columns=4, swatch_width=32, swatch_height=32,
+                                   max_colors=10, gap=8, label=True):
+    """
+    Tiles the dominant colour strips of every image into one contact sheet,
+    written directly with PIL, in place of a matplotlib palette figure per
+    image.
+
+    Parameter:
+    - source: The folder of per-image r, g, b, radio tables, e.g.
+      export_path/csv, or a ColourStore.
+    - output_image_path: The PNG written.
+    - columns: The number of strips per row.
+    - swatch_width, swatch_height: The size of a colour swatch in pixels.
+    - max_colors: The number of swatches per strip; tables are sorted by
+      pixel fraction, so these are the most dominant colours.
+    - gap: The margin around every strip in pixels.
+    - label: Write the image name above its strip. Names the font cannot
+      show (e.g. Chinese names when no CJK font is installed) are written
+      as their position on the sheet, #1, #2, ..., instead.
+
+    Returns:
+    - The number of tables on the sheet; nothing is written for none.
+    """
+    from PIL import ImageDraw
+
+    from .colors import palette_strip
+
+    if isinstance(source, str):
+        names = [f[:-len('.csv')] for f in sorted(os.listdir(source)) if f.endswith('.csv')]
+
+        def image_colors(name):
+            return pd.read_csv(os.path.join(source, name + '.csv'), usecols=['r', 'g', 'b']).values
+    else:
+        names = sorted(source.ids)
+
+        def image_colors(name):
+            return source.color_matrix(name)[:, :3]
+
+    if not names:
+        return 0
+    label_height = 12 if label else 0
+    cell_width, cell_height = swatch_width * max_colors + gap, swatch_height + label_height + gap
+    n_rows = -(-len(names) // columns)
+    sheet = np.full((gap + n_rows * cell_height, gap + columns * cell_width, 3), 255, dtype=np.uint8)
+    origins = []
+    for i, name in enumerate(names):
+        x, y = gap + (i % columns) * cell_width, gap + (i // columns) * cell_height
+        strip = palette_strip(image_colors(name)[:max_colors], swatch_width, swatch_height)
+        sheet[y + label_height:y + label_height + swatch_height, x:x + strip.shape[1]] = strip
+        origins.append((x, y))
+
+    image = Image.fromarray(sheet)
+    if label:
+        draw = ImageDraw.Draw(image)
+        font, cjk = _label_font()
+        max_chars = swatch_width * max_colors // 6
+        for i, (name, (x, y)) in enumerate(zip(names, origins)):
+            # 默认字体只有 latin-1 字形：位图字体遇到中文会抛出 UnicodeEncodeError，FreeType 字体会画成方框
+            text = name[:max_chars] if cjk or _latin1(name) else f"#{i + 1}"
+            draw.text((x, y), text, fill=(0, 0, 0), font=font)
+    image.save(output_image_path)
+    return len(names)
+
+
+def render_cached(render_fn, csv_file_path, output_image_path, cache_dir, **params):
+    """
+    Renders output_image_path with render_fn(csv_file_path, output_image_path,
+    **params), reusing an earlier render when nothing it depends on changed.
+
+    Renders are stored in cache_dir under a SHA-256 hash of the colour table
+    contents, the renderer name, RENDER_CACHE_VERSION and the parameters
+    (including the seed), and copied to output_image_path, so unchanged
+    palettes skip rendering.
+
+    Returns:
+    - The path of the cached render.
+    """
+    digest = hashlib.sha256()
+    with open(csv_file_path, 'rb') as csv_file:
+        digest.update(csv_file.read())
+    # show 只影响是否显示，不影响生成的图像
+    key_params = {name: value for name, value in params.items() if name != "show"}
+    digest.update(json.dumps({"renderer": render_fn.__name__, "version": RENDER_CACHE_VERSION,
+                              "params": key_params}, sort_keys=True, default=str).encode('utf-8'))
+    key = digest.hexdigest()
+    extension = os.path.splitext(output_image_path)[1]
+    cached_path = os.path.join(cache_dir, key + extension)
+
+    if not os.path.exists(cached_path):
+        os.makedirs(cache_dir, exist_ok=True)
+        # 先写临时文件再改名，中断时不会留下不完整的缓存
+        tmp_path = os.path.join(cache_dir, key + '.tmp' + extension)
+        render_fn(csv_file_path, tmp_path, **params)
+        os.replace(tmp_path, cached_path)
+    shutil.copyfile(cached_path, output_image_path)
+    return cached_path
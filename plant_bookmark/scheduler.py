@@ -0,0 +1,244 @@
+"""Runs the pipeline for many (park, season, input folder) jobs across processes."""
+
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import partial
+
+from .figures import use_headless_backend
+from .manifest import PipelineManifest
+from .pipeline import STAGES, histogram_path, pending_photos, run_pipeline
+
+# 分割阶段在 CPU 密集的进程池中运行，其余阶段（Vision 请求、表格、渲染）在另一个进程池中运行
+SEGMENT_STAGES = ("segment",)
+IO_STAGES = ("colors", "aggregate", "render")
+
+
+def load_jobs(jobs_path, export_root):
+    """
+    Reads the job list, a CSV file with the columns park, season and
+    input_path, and optionally export_path and base_name.
+
+    Parameter:
+    - jobs_path: The CSV file.
+    - export_root: The outputs of a job without export_path go to
+      export_root/park/season.
+
+    Returns:
+    - A list of job dicts with all five keys; base_name defaults to
+      park_season.
+    """
+    jobs = []
+    with open(jobs_path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            park, season = row['park'].strip(), row['season'].strip()
+            jobs.append({
+                'park': park,
+                'season': season,
+                'input_path': row['input_path'].strip(),
+                'export_path': (row.get('export_path') or '').strip() or os.path.join(export_root, park, season),
+                'base_name': (row.get('base_name') or '').strip() or f"{park}_{season}",
+            })
+    return jobs
+
+
+def _init_worker(n_threads, uses_torch=False):
+    # 每个进程只使用分到的线程数，避免多个进程的 torch/OpenCV 线程互相争抢 CPU
+    os.environ["OMP_NUM_THREADS"] = str(n_threads)
+    use_headless_backend()
+    # 分割进程总要设置 torch 线程数；spawn 启动的进程此时还没有导入 torch，否则会按全部 CPU 开线程
+    if uses_torch or "torch" in sys.modules:
+        import torch
+
+        torch.set_num_threads(n_threads)
+    if "cv2" in sys.modules:
+        import cv2
+
+        cv2.setNumThreads(n_threads)
+
+
+def _has_pending_photos(job, histogram_space=None):
+    # 重新运行已完成的任务时不必加载模型；找不到的文件夹留给任务本身报错
+    if not os.path.isdir(job['input_path']):
+        return True
+    manifest = PipelineManifest(os.path.join(job['export_path'], "manifest.json"))
+    hist_path = histogram_path(job['export_path']) if histogram_space else None
+    return bool(pending_photos(manifest, job['input_path'], hist_path)[0])
+
+
+_WORKER_MODELS = {}
+
+
+def _worker_model(checkpoint, inference_mode, calibration_path):
+    # 每个进程只构建一次模型；fp32 模型在 fork 之前已由主进程加载到共享内存中
+    key = (checkpoint, inference_mode, calibration_path)
+    if key not in _WORKER_MODELS:
+        if inference_mode == "fp32":
+            from .model import get_shared_model
+
+            _WORKER_MODELS[key] = get_shared_model(checkpoint)
+        else:
+            from .inference import optimize_for_inference
+            from .model import load_model
+
+            _WORKER_MODELS[key] = optimize_for_inference(load_model(checkpoint), inference_mode,
+                                                         calibration_path=calibration_path)
+    return _WORKER_MODELS[key]
+
+
+def _run_job_stages(job, stages, options):
+    start = time.perf_counter()
+    # 只有在有待分割的照片时，run_pipeline 才会调用它构建模型
+    model_loader = partial(_worker_model, options.get("checkpoint"), options.get("inference_mode", "fp32"),
+                           options.get("calibration_path"))
+    results = run_pipeline(job['input_path'], job['export_path'], job['base_name'], stages=stages,
+                           model_loader=model_loader, **options)
+    return {"seconds": time.perf_counter() - start, "results": results}
+
+
+class JobStatus:
+    """
+    Keeps the state of every job and rewrites the status JSON file on each
+    change, so the progress of a long run can be followed from outside.
+    """
+    def __init__(self, jobs, path=None):
+        self.path = path
+        self.jobs = [dict(job, state="pending", stages={}, error=None) for job in jobs]
+        self.save()
+
+    def update(self, index, state, stage_group=None, result=None, error=None):
+        job = self.jobs[index]
+        job["state"] = state
+        if stage_group is not None and result is not None:
+            job["stages"][stage_group] = result
+        if error is not None:
+            job["error"] = error
+        print(f"[{job['park']}/{job['season']}] {state}"
+              + (f" ({result['seconds']:.1f}s)" if result is not None else "")
+              + (f"\n{error}" if error is not None else ""))
+        self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.jobs, f, ensure_ascii=False, indent=1, default=str)
+        os.replace(tmp_path, self.path)
+
+
+def cpu_budget(n_cpus, segment_workers=None, io_workers=None, num_workers=None, both_pools=True):
+    """
+    Divides the CPUs between the two process pools, so that the torch and
+    decoding threads of the segment workers and the io processes together
+    do not exceed n_cpus (except on machines too small to give everything
+    one CPU).
+
+    The io pool gets its CPUs first, one per process; the rest is split
+    among the segment workers, and the share of every segment worker
+    between its decoding threads (about a quarter) and torch threads.
+
+    Parameter:
+    - n_cpus: The CPUs available, e.g. os.cpu_count().
+    - segment_workers, io_workers, num_workers: Requested values; None picks
+      one from the budget. num_workers is capped by the share of a worker.
+    - both_pools: Whether the two pools run at the same time; otherwise
+      each can use all CPUs.
+
+    Returns:
+    - segment_workers, io_workers, torch_threads per segment worker and
+      decoding threads (num_workers) per segment worker.
+    """
+    if io_workers is None:
+        io_workers = max(1, min(4, n_cpus // 4)) if both_pools else min(4, n_cpus)
+    remaining = max(1, n_cpus - io_workers) if both_pools else n_cpus
+    segment_workers = segment_workers or max(1, remaining // 4)
+    share = max(1, remaining // segment_workers)
+    # 每个分割进程分到的 CPU 中约四分之一用于解码，其余给 torch
+    decode_threads = min(num_workers or 2, max(1, share // 4))
+    torch_threads = max(1, share - decode_threads)
+    return segment_workers, io_workers, torch_threads, decode_threads
+
+
+def run_jobs(jobs, stages=STAGES, segment_workers=None, io_workers=None, status_path=None, **options):
+    """
+    Runs the pipeline for many jobs in two process pools: one for the CPU
+    heavy segment stage and one for the colours, aggregate and render
+    stages, each with its own concurrency limit. A job moves to the second
+    pool as soon as its segmentation finishes, so segmentation of the next
+    folders overlaps with the rendering of the previous ones.
+
+    A failing job is reported and recorded in the status file without
+    stopping the others; since every stage is incremental, re-running the
+    same jobs only redoes the unfinished work.
+
+    Parameter:
+    - jobs: Job dicts as returned by load_jobs.
+    - stages: The stages to run, a subset of STAGES.
+    - segment_workers: Segmentation processes; defaults to a quarter of the
+      CPUs left after the io pool.
+    - io_workers: Processes for the other stages; defaults to a quarter of
+      the CPUs, at most 4. The torch and decoding threads of every segment
+      worker are sized from the same CPU count, see cpu_budget.
+    - status_path: Optional JSON file the per-job progress is written to.
+    - options: Passed to run_pipeline, e.g. checkpoint or batch_size.
+
+    Returns:
+    - The list of job statuses, with state "done" or "failed".
+    """
+    segment_stages = [stage for stage in stages if stage in SEGMENT_STAGES]
+    io_stages = [stage for stage in stages if stage in IO_STAGES]
+    segment_workers, io_workers, torch_threads, options["num_workers"] = cpu_budget(
+        os.cpu_count() or 1, segment_workers, io_workers, options.get("num_workers"),
+        both_pools=bool(segment_stages and io_stages))
+
+    # 有 fork 时先在主进程加载 fp32 模型，子进程通过写时复制共享同一份权重
+    can_fork = "fork" in multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if can_fork else "spawn")
+    histogram_space = options.get("histogram_space") or (
+        "Lab" if options.get("palette_source") == "histogram" else None)
+    if (can_fork and segment_stages and options.get("inference_mode", "fp32") == "fp32"
+            and any(_has_pending_photos(job, histogram_space) for job in jobs)):
+        from .model import get_shared_model
+
+        get_shared_model(options.get("checkpoint"))
+
+    status = JobStatus(jobs, status_path)
+    futures = {}
+    with ProcessPoolExecutor(segment_workers, mp_context=context, initializer=_init_worker,
+                             initargs=(torch_threads, True)) as segment_pool, \
+            ProcessPoolExecutor(io_workers, mp_context=context, initializer=_init_worker,
+                                initargs=(1,)) as io_pool:
+
+        def submit(index, group):
+            pool, group_stages = (segment_pool, segment_stages) if group == "segment" else (io_pool, io_stages)
+            futures[pool.submit(_run_job_stages, jobs[index], group_stages, options)] = (index, group)
+            status.update(index, "queued " + ",".join(group_stages))
+
+        for index in range(len(jobs)):
+            if segment_stages:
+                submit(index, "segment")
+            elif io_stages:
+                submit(index, "io")
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, group = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = "".join(traceback.format_exception(type(e), e, e.__traceback__))
+                    status.update(index, "failed", error=error)
+                    continue
+                if group == "segment" and io_stages:
+                    status.update(index, "segmented", group, result)
+                    submit(index, "io")
+                else:
+                    status.update(index, "done", group, result)
+    return status.jobs
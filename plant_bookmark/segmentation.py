@@ -0,0 +1,291 @@
+"""Batched vegetation segmentation of photo folders."""
+
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+from segmentation_models_pytorch.encoders import get_preprocessing_fn
+from torch.utils.data import Dataset
+
+from .profiling import span
+
+# JPEG 可以在解码时直接缩小 1/2、1/4、1/8，省去大部分解码工作
+REDUCED_READ_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                      (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def reduced_read_flag(image_path, new_width, new_height):
+    # 只读取文件头获得尺寸，选择解码后仍不小于目标尺寸的最大缩小倍数（不论照片横竖）
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+    except (OSError, ValueError):
+        return cv2.IMREAD_COLOR
+    for factor, flag in REDUCED_READ_FLAGS:
+        if min(width, height) // factor >= max(new_width, new_height):
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def read_image(image_path, flag=cv2.IMREAD_COLOR):
+    # 无法读取的文件返回 None，而不是抛出异常
+    try:
+        return cv2.imread(image_path, flag)
+    except cv2.error:
+        return None
+
+
+def resize_image(image_path, new_width, new_height):
+    img = read_image(image_path, reduced_read_flag(image_path, new_width, new_height))
+    if img is None:
+        return None
+    resized_img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
+    return resized_img
+
+
+class PlantImageDataset(Dataset):
+    """
+    Decodes, resizes and preprocesses the photos of a folder. load_images runs
+    it in a thread pool, so the next batch is prepared while the model runs on
+    the current one.
+
+    Parameter:
+    - input_path: The folder containing the original photos.
+    - filenames: The photos to load, relative to input_path.
+    - size: (width, height) the photos are resized to, both multiples of 32;
+      None keeps the full resolution (for segment_image_tiled).
+    - encoder_name: The encoder whose imagenet preprocessing is applied.
+    - normalize: Apply the preprocessing; when False the inputs stay raw uint8,
+      for models with the normalisation folded in (see FoldedVegAnn).
+
+    Each item is (filename, im, inputs): the resized RGB uint8 photo and the
+    preprocessed float32 (or raw uint8) (3, H, W) tensor. For files that cannot
+    be read, im and inputs are None.
+    """
+    def __init__(self, input_path, filenames, size=(384, 512), encoder_name="resnet34", normalize=True):
+        self.input_path = input_path
+        self.filenames = list(filenames)
+        self.size = size
+        self.preprocess_input = get_preprocessing_fn(encoder_name, pretrained="imagenet") if normalize else None
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def __getitem__(self, idx):
+        filename = self.filenames[idx]
+        with span("decode", filename):
+            return self._load(filename)
+
+    def _load(self, filename):
+        if self.size is None:
+            image = read_image(os.path.join(self.input_path, filename))
+        else:
+            image = resize_image(os.path.join(self.input_path, filename), *self.size)
+        if image is None:
+            return filename, None, None
+        im = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        if self.preprocess_input is None:
+            return filename, im, torch.from_numpy(im).permute(2, 0, 1)
+        inputs = self.preprocess_input(im).astype('float32')
+        inputs = torch.from_numpy(inputs).permute(2, 0, 1)
+        return filename, im, inputs
+
+
+def load_images(dataset, num_threads=4, prefetch=16):
+    """
+    Yields the items of a PlantImageDataset in order while a thread pool
+    decodes up to prefetch items ahead. OpenCV releases the GIL while decoding
+    and resizing, so the threads run alongside model inference.
+    """
+    with ThreadPoolExecutor(max_workers=max(num_threads, 1)) as pool:
+        pending = deque()
+        for idx in range(len(dataset)):
+            pending.append(pool.submit(dataset.__getitem__, idx))
+            if len(pending) >= prefetch:
+                yield _next_loaded(pending)
+        while pending:
+            yield _next_loaded(pending)
+
+
+def _next_loaded(pending):
+    # 等待解码线程的时间：明显大于 0 说明解码跟不上推理
+    with span("decode_wait"):
+        return pending.popleft().result()
+
+
+def collate_images(batch):
+    # 文件名保持为列表，原图堆叠为 NHWC 数组，模型输入堆叠为 NCHW 张量
+    filenames, ims, inputs = zip(*batch)
+    return list(filenames), np.stack(ims), torch.stack(inputs)
+
+
+def _tile_starts(length, tile, stride):
+    # 等间距切分，最后一块与边缘对齐
+    if length <= tile:
+        return [0]
+    return list(range(0, length - tile, stride)) + [length - tile]
+
+
+def _blend_window(height, width, overlap):
+    # 重叠区域内权重线性过渡，拼接处不会出现接缝
+    def ramp(n):
+        w = np.minimum(1.0, (np.arange(n) + 1) / (overlap + 1))
+        return np.minimum(w, w[::-1]).astype(np.float32)
+    return np.outer(ramp(height), ramp(width))
+
+
+def segment_image_tiled(model, im, tile_size=512, overlap=64, batch_size=8, threshold=0.5, preprocess_input=None):
+    """
+    Segments a full-resolution photo in overlapping tiles and blends the tile
+    probabilities back into one full-resolution mask.
+
+    Tiles are processed one row at a time and the rows of the mask are
+    finished as soon as no later tile overlaps them, so besides the mask only
+    about tile_size rows of probabilities are held, never the full-resolution
+    float tensor or the activations of the whole photo.
+
+    Parameter:
+    - model: The segmentation network, see segment_folder.
+    - im: The (H, W, 3) RGB uint8 photo.
+    - tile_size: The tile side, a multiple of 32; photos smaller than a tile
+      use the smallest multiple of 32 covering them.
+    - overlap: The number of pixels neighbouring tiles share.
+    - batch_size: The number of tiles per forward pass.
+    - threshold: The probability above which a pixel counts as vegetation.
+    - preprocess_input: The input preprocessing for models without raw_input;
+      defaults to the resnet34 imagenet preprocessing.
+
+    Returns:
+    - The (H, W) uint8 vegetation mask.
+    """
+    if tile_size % 32 or not 0 <= overlap < tile_size:
+        raise ValueError("tile_size must be a multiple of 32 larger than overlap")
+    raw_input = getattr(model, "raw_input", False)
+    if not raw_input and preprocess_input is None:
+        preprocess_input = get_preprocessing_fn("resnet34", pretrained="imagenet")
+
+    height, width = im.shape[:2]
+    tile_h = min(tile_size, -(-height // 32) * 32)
+    tile_w = min(tile_size, -(-width // 32) * 32)
+    if height < tile_h or width < tile_w:
+        im = np.pad(im, ((0, max(tile_h - height, 0)), (0, max(tile_w - width, 0)), (0, 0)), mode="reflect")
+    padded_w = im.shape[1]
+    ys = _tile_starts(im.shape[0], tile_h, tile_h - overlap)
+    xs = _tile_starts(padded_w, tile_w, tile_w - overlap)
+    window = _blend_window(tile_h, tile_w, overlap)
+
+    mask = np.empty((height, width), dtype=np.uint8)
+    # 只保留当前一行瓦片覆盖的概率累加区域
+    acc = np.zeros((tile_h, padded_w), dtype=np.float32)
+    weight = np.zeros((tile_h, padded_w), dtype=np.float32)
+
+    def finish_rows(top, n_rows):
+        rows = slice(top, min(top + n_rows, height))
+        n = rows.stop - rows.start
+        if n > 0:
+            mask[rows] = (acc[:n, :width] > threshold * weight[:n, :width])
+
+    top = 0
+    for y in ys:
+        shift = y - top
+        if shift:
+            finish_rows(top, shift)
+            acc[:tile_h - shift] = acc[shift:]
+            acc[tile_h - shift:] = 0
+            weight[:tile_h - shift] = weight[shift:]
+            weight[tile_h - shift:] = 0
+            top = y
+        for start in range(0, len(xs), batch_size):
+            batch_xs = xs[start:start + batch_size]
+            tiles = np.stack([im[y:y + tile_h, x:x + tile_w] for x in batch_xs])
+            if raw_input:
+                inputs = torch.from_numpy(tiles).permute(0, 3, 1, 2)
+            else:
+                inputs = torch.from_numpy(preprocess_input(tiles).astype('float32')).permute(0, 3, 1, 2)
+            probs = model(inputs).sigmoid().float().numpy()[:, 0]
+            for x, prob in zip(batch_xs, probs):
+                acc[:, x:x + tile_w] += prob * window
+                weight[:, x:x + tile_w] += window
+    finish_rows(top, tile_h)
+    return mask
+
+
+def segment_folder(model, input_path, consumer, filenames=None, batch_size=8, num_workers=None, threshold=0.5,
+                   tile_size=None, tile_overlap=64, on_skip=None):
+    """
+    Runs VegAnnModel over the photos of a folder in batches and passes every
+    prediction to a downstream consumer.
+
+    Parameter:
+    - model: A VegAnnModel with its weights loaded, or a network with the
+      normalisation folded in (raw_input set, see load_compiled_model).
+    - input_path: The folder containing the original photos.
+    - consumer: Called as consumer(filename, im, pred) for every photo, with im the
+      resized RGB photo and pred the (H, W) uint8 vegetation mask.
+    - filenames: The photos to segment; defaults to every file in input_path.
+    - batch_size: The number of photos per forward pass.
+    - num_workers: Threads used for decoding; defaults to min(4, cpu count).
+    - threshold: The probability above which a pixel counts as vegetation.
+    - tile_size: Segment the photos at full resolution in tiles of this size
+      (see segment_image_tiled) instead of resizing them to 384x512; im and
+      pred are then full resolution and batch_size counts tiles.
+    - tile_overlap: The number of pixels neighbouring tiles share.
+    - on_skip: Called as on_skip(filename) for every photo that cannot be
+      read, e.g. to record it in the manifest.
+
+    Photos that cannot be read are reported and skipped.
+
+    Returns:
+    - The number of photos segmented.
+    """
+    if filenames is None:
+        filenames = sorted(os.listdir(input_path))
+    if num_workers is None:
+        num_workers = min(4, os.cpu_count() or 1)
+    raw_input = getattr(model, "raw_input", False)
+    model.eval()
+
+    if tile_size:
+        # 全分辨率照片占内存较多，只提前解码一两张
+        dataset = PlantImageDataset(input_path, filenames, size=None, normalize=False)
+        preprocess_input = None if raw_input else get_preprocessing_fn("resnet34", pretrained="imagenet")
+        prefetch = 2
+    else:
+        dataset = PlantImageDataset(input_path, filenames, normalize=not raw_input)
+        prefetch = 2 * batch_size
+
+    def run_batch(batch):
+        names, ims, inputs = collate_images(batch)
+        with span("forward", count=len(names)):
+            logits = model(inputs)
+            preds = (logits.sigmoid() > threshold).numpy().astype(np.uint8)
+        for filename, im, pred in zip(names, ims, preds):
+            consumer(filename, im, pred[0])
+
+    count = 0
+    batch = []
+    with torch.inference_mode():
+        for filename, im, inputs in load_images(dataset, num_workers, prefetch):
+            if im is None:
+                print(f"Skipped unreadable image {os.path.join(input_path, filename)}")
+                if on_skip is not None:
+                    on_skip(filename)
+                continue
+            count += 1
+            if tile_size:
+                with span("forward", filename):
+                    pred = segment_image_tiled(model, im, tile_size, tile_overlap, batch_size, threshold,
+                                               preprocess_input)
+                consumer(filename, im, pred)
+                continue
+            batch.append((filename, im, inputs))
+            if len(batch) == batch_size:
+                run_batch(batch)
+                batch = []
+        if batch:
+            run_batch(batch)
+    return count
@@ -0,0 +1,277 @@
+"""Colour tables: per-image processing, aggregation and colour spaces."""
+
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class MaskColorWriter:
+    """
+    Appends the mean colour of every segmented image to a CSV file, one row per
+    image, and writes the Excel export once at the end of the run.
+
+    Each row is flushed as soon as it is appended, so an interrupted run keeps
+    every row written so far.
+
+    Parameter:
+    - csv_path: The CSV file rows are appended to.
+    - resume: Keep the rows of an existing csv_path instead of starting over.
+    """
+    columns = ['id', 'R', 'G', 'B']
+
+    def __init__(self, csv_path, resume=False):
+        self.csv_path = csv_path
+        write_header = not resume or not os.path.exists(csv_path) or os.path.getsize(csv_path) == 0
+        self._file = open(csv_path, 'a' if resume else 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        if write_header:
+            self._writer.writerow(self.columns)
+            self._file.flush()
+
+    def append(self, image_id, color):
+        self._writer.writerow([image_id] + [float(c) for c in color])
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def export_excel(self, xlsx_path):
+        # 只在结束时读取一次 CSV 并写出 Excel；重新处理过的图片只保留最新一行
+        self.close()
+        data = pd.read_csv(self.csv_path).drop_duplicates(subset='id', keep='last')
+        data.to_excel(xlsx_path, index=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def process_csv_single_param(file_path, drop_dark=True):
+    """
+    Processes the CSV file to filter out rows where the sum of r, g, b is greater than 150,
+    adds a 'Ratio' column to calculate each row's radio in relation to the sum of the 'radio' column,
+    and adds an 'id' column filled with the filename (without the extension) derived from the file path.
+
+    Parameter:
+    - file_path: The path to the CSV file.
+    - drop_dark: Filter out the dark rows, i.e. the black background of the
+      seg/ PNGs. Tables extracted in memory only sample the vegetation
+      pixels, so their dark colours are shaded leaves and are kept with False.
+
+    Returns:
+    - A pandas DataFrame after applying the above operations.
+    """
+    # Extract the filename without the extension from the file path
+    filename_without_extension = file_path.split('/')[-1].split('.')[0]
+
+    # Load the CSV file
+    df = pd.read_csv(file_path)
+
+    # Filter rows where the sum of r, g, b is less than or equal to 150
+    filtered_df = df[df[['r', 'g', 'b']].sum(axis=1) >= 60] if drop_dark else df.copy()
+
+    # Calculate the total 'radio' for the ratio calculation
+    total_radio = filtered_df['radio'].sum()
+
+    # Add 'Ratio' column
+    filtered_df['Ratio'] = filtered_df['radio'] / total_radio
+
+    # Add 'id' column with the filename without extension
+    filtered_df['id'] = filename_without_extension
+
+    return filtered_df
+
+
+def process_csv(input_filename,output_folder_path):
+
+    processed_df = process_csv_single_param(input_filename)
+
+    processed_files = {}
+
+    processed_files[input_filename.split('/')[-1].split('.')[0]] = processed_df
+    print(processed_files.keys())
+    print(processed_files)
+    # Ensure the output folder exists, if not, create it
+    os.makedirs(output_folder_path, exist_ok=True)
+
+    #file_base_name = filename.split('.')[0]
+    for filename, df in processed_files.items():
+        output_file_path = os.path.join(output_folder_path, f"{filename}_processed.csv")
+        processed_df.to_csv(output_file_path, index=False)
+    return f"Processed files saved to {output_folder_path}"
+
+
+def concatenate_csv(output_filename, processed_folder):
+    # 先收集所有表格，最后只拼接一次
+    frames = []
+
+    # 遍历文件夹中的所有文件
+    for filename in os.listdir(processed_folder):
+            # 读取CSV文件
+            frames.append(pd.read_csv(os.path.join(processed_folder, filename)))
+
+    combined_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    # 将结果保存到新的CSV文件中
+    combined_df.to_csv(output_filename, index=False)
+    print(f'Combined CSV saved as {output_filename}')
+
+
+def rgb_to_hsv_normalized(r, g, b):
+    # 将RGB值从0-255范围转换到0-1范围，r、g、b 可以是单个数值，也可以是整列数组
+    rgb_normalized = np.stack([r, g, b], axis=-1) / 255.0
+    # 使用colour库转换RGB到HSV
+    hsv = rgb_to_hsv_array(rgb_normalized)
+    return hsv
+
+
+def rgb_to_hsv_array(rgb_normalized):
+    """
+    Converts 0-1 RGB values, an array of any shape ending in 3, to HSV with
+    H, S and V in 0-1, with the same formula as colour.RGB_to_HSV but in
+    plain numpy, so tables with only HSV columns do not import colour-science
+    (about 1.5 s).
+    """
+    rgb = np.asarray(rgb_normalized, dtype=np.float64)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    maximum, minimum = rgb.max(axis=-1), rgb.min(axis=-1)
+    delta = maximum - minimum
+
+    def safe_divide(a, b):
+        return np.divide(a, b, out=np.zeros(np.broadcast(a, b).shape), where=b != 0)
+
+    saturation = safe_divide(delta, maximum)
+    delta_r = safe_divide((maximum - r) / 6 + delta / 2, delta)
+    delta_g = safe_divide((maximum - g) / 6 + delta / 2, delta)
+    delta_b = safe_divide((maximum - b) / 6 + delta / 2, delta)
+    hue = delta_b - delta_g
+    hue = np.where(maximum == g, 1 / 3 + delta_r - delta_b, hue)
+    hue = np.where(maximum == b, 2 / 3 + delta_g - delta_r, hue)
+    hue = np.where(hue < 0, hue + 1, hue)
+    hue = np.where(hue > 1, hue - 1, hue)
+    hue = np.where(delta == 0, 0, hue)
+    return np.stack([hue, saturation, maximum], axis=-1)
+
+
+def _colour():
+    # colour-science 导入时会改动 numpy 的全局打印选项（之后 pandas 写 CSV 只保留 12 位有效数字），导入后恢复
+    options = np.get_printoptions()
+    import colour
+
+    np.set_printoptions(**options)
+    return colour
+
+
+def rgb_to_lab_normalized(rgb_normalized):
+    colour = _colour()
+
+    # sRGB -> XYZ -> CIE Lab（D65），L 的范围为 0-100
+    return colour.XYZ_to_Lab(colour.sRGB_to_XYZ(rgb_normalized))
+
+
+def rgb_to_lch_normalized(rgb_normalized):
+    colour = _colour()
+
+    return colour.Lab_to_LCHab(rgb_to_lab_normalized(rgb_normalized))
+
+
+# 可选的色彩空间：新增的列名，以及对 (N, 3) 的 0-1 RGB 数组整体转换的函数
+COLOUR_SPACES = {
+    "HSV": (['Hue', 'Saturation', 'Value'], rgb_to_hsv_array),
+    "Lab": (['Lab_L', 'Lab_a', 'Lab_b'], rgb_to_lab_normalized),
+    "LCh": (['LCh_L', 'LCh_C', 'LCh_h'], rgb_to_lch_normalized),
+}
+
+
+def add_colour_space_columns(df, spaces=("HSV",)):
+    """
+    Adds colour space columns to a colour table, converting the whole r, g, b
+    column block as one array instead of row by row.
+
+    Parameter:
+    - df: A DataFrame with 'r', 'g' and 'b' columns in the 0-255 range.
+    - spaces: The keys of COLOUR_SPACES to add, e.g. ("HSV", "Lab", "LCh").
+
+    Returns:
+    - df, with the new columns added in place.
+    """
+    rgb_normalized = df[['r', 'g', 'b']].to_numpy(dtype=float) / 255.0
+    for space in spaces:
+        columns, convert = COLOUR_SPACES[space]
+        values = np.asarray(convert(rgb_normalized)).reshape(len(df), 3)
+        for i, column in enumerate(columns):
+            df[column] = values[:, i]
+    return df
+
+
+def process_csv_with_colour(input_filename, output_filename, spaces=("HSV",)):
+    # 读取CSV文件
+    df = pd.read_csv(input_filename)
+
+    add_colour_space_columns(df, spaces)
+
+    # 保存到新的CSV文件
+    df.to_csv(output_filename, index=False)
+    print(f'Processed file saved as {output_filename}')
+
+
+# combined 表格的列；HSV 表格在其后加上各色彩空间的列
+COMBINED_COLUMNS = ['r', 'g', 'b', 'radio', 'Ratio', 'id']
+
+
+def write_empty_color_tables(combined_filename, hsv_filename, spaces=("HSV",)):
+    # 只有表头的 combined 表格和 HSV 表格
+    pd.DataFrame(columns=COMBINED_COLUMNS).to_csv(combined_filename, index=False)
+    space_columns = [column for space in spaces for column in COLOUR_SPACES[space][0]]
+    pd.DataFrame(columns=COMBINED_COLUMNS + space_columns).to_csv(hsv_filename, index=False)
+
+
+def aggregate_color_tables(csv_folder, combined_filename, hsv_filename, processed_folder=None, spaces=("HSV",),
+                           drop_dark=True):
+    """
+    Runs the processing, concatenation and HSV stages over the per-image colour
+    tables in a single pass. Each table is read once, processed with
+    process_csv_single_param and appended to both the combined and the HSV
+    CSV files, so only one image's table is held in memory at a time.
+
+    Parameter:
+    - csv_folder: The folder containing the per-image colour tables.
+    - combined_filename: The combined CSV file to write.
+    - hsv_filename: The combined CSV file with HSV columns to write.
+    - processed_folder: If given, the processed per-image tables are also
+      written there as <id>_processed.csv.
+    - spaces: The colour spaces added to the HSV file, see COLOUR_SPACES.
+    - drop_dark: Passed to process_csv_single_param.
+
+    Returns:
+    - The number of tables aggregated. Both files are rewritten even when it
+      is 0, with only their header.
+    """
+    count = 0
+    for filename in sorted(os.listdir(csv_folder)):
+        df = process_csv_single_param(os.path.join(csv_folder, filename), drop_dark)
+        if processed_folder is not None:
+            os.makedirs(processed_folder, exist_ok=True)
+            df.to_csv(os.path.join(processed_folder, f"{filename.split('.')[0]}_processed.csv"), index=False)
+        if df.empty:
+            continue
+        # 第一张表覆盖写入并带表头，之后的表追加
+        mode = 'a' if count else 'w'
+        df.to_csv(combined_filename, mode=mode, header=not count, index=False)
+        add_colour_space_columns(df, spaces).to_csv(hsv_filename, mode=mode, header=not count, index=False)
+        count += 1
+    if not count:
+        # 没有可用的颜色时也覆盖两个表格，不让上次运行的表格被当作本次结果渲染
+        write_empty_color_tables(combined_filename, hsv_filename, spaces)
+        print(f'No colours to aggregate in {csv_folder}, wrote empty tables')
+        return count
+    print(f'Combined CSV saved as {combined_filename}')
+    print(f'Processed file saved as {hsv_filename}')
+    return count
@@ -0,0 +1,296 @@
+"""Vector (SVG/PDF) bookmarks and rasters at several resolutions from one geometry."""
+
+import os
+import zlib
+from collections import defaultdict
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from .render import floral_circles, floral_extent, voronoi_seeds
+
+VECTOR_FORMATS = ("svg", "pdf")
+MM_PER_INCH = 25.4
+# matplotlib 版本以 dpi=100 渲染，默认 1 个单位对应 1/100 英寸
+UNITS_PER_INCH = 100
+# 圆的四段三次贝塞尔曲线近似所用的控制点系数
+_BEZIER_CIRCLE = 0.5522847498
+
+
+def _num(value):
+    # 保留两位小数并去掉多余的 0，使文件更小
+    text = f"{value:.2f}".rstrip("0").rstrip(".")
+    return "0" if text in ("", "-0") else text
+
+
+def _hex(color):
+    return "#%02x%02x%02x" % tuple(int(c) for c in color)
+
+
+def merge_polygons(polygons, decimals=6):
+    """
+    Merges polygons of one colour into the boundary rings of their union.
+    All polygons are oriented the same way, so an edge shared by two
+    neighbours appears once in each direction and cancels; the remaining
+    edges are chained into rings. Holes come out oriented opposite to the
+    outer rings and are left empty by the nonzero fill rule of SVG and PDF.
+
+    Parameter:
+    - polygons: (K, 2) vertex arrays; neighbours must share exact vertices,
+      as the cells of one Voronoi diagram do.
+    - decimals: Vertices equal after rounding to this many decimals are
+      treated as the same vertex.
+
+    Returns:
+    - A list of (K, 2) rings.
+    """
+    edges = defaultdict(int)
+    coordinates = {}
+    for polygon in polygons:
+        polygon = np.asarray(polygon, dtype=np.float64)
+        if len(polygon) < 3:
+            continue
+        x, y = polygon[:, 0], polygon[:, 1]
+        if np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y) < 0:
+            polygon = polygon[::-1]
+        keys = [tuple(key) for key in np.round(polygon, decimals)]
+        for key, vertex in zip(keys, polygon):
+            coordinates.setdefault(key, vertex)
+        for a, b in zip(keys, keys[1:] + keys[:1]):
+            if a == b:
+                continue
+            if edges.get((b, a)):
+                edges[(b, a)] -= 1
+            else:
+                edges[(a, b)] += 1
+
+    outgoing = defaultdict(list)
+    for (a, b), count in edges.items():
+        # 抵消后次数为 0 的边不再出现
+        if count:
+            outgoing[a].extend([b] * count)
+    rings = []
+    # 每个顶点的出边和入边数目相同，从任一顶点出发总能回到起点
+    while outgoing:
+        start = next(iter(outgoing))
+        ring, current = [start], start
+        while True:
+            following = outgoing[current].pop()
+            if not outgoing[current]:
+                del outgoing[current]
+            if following == start:
+                break
+            ring.append(following)
+            current = following
+        if len(ring) >= 3:
+            rings.append(np.array([coordinates[key] for key in ring]))
+    return rings
+
+
+class BookmarkGeometry:
+    """
+    The shapes of a bookmark in drawing order, computed once and then written
+    as SVG or PDF and rasterized at any number of resolutions.
+
+    Coordinates are layout units on a width x height canvas with y pointing
+    down; by default a unit is 1/100 inch (see UNITS_PER_INCH), the scale of
+    the PNG renderers.
+
+    Parameter:
+    - width, height: The canvas size in units.
+    - background: The canvas colour.
+    """
+    def __init__(self, width, height, background=(255, 255, 255)):
+        self.width = width
+        self.height = height
+        self.background = tuple(int(c) for c in background)
+        self.layers = []
+
+    def add_polygons(self, color, polygons):
+        # 同一颜色的多边形作为一层，导出矢量图时合并为一条路径
+        self.layers.append(("polygons", tuple(int(c) for c in color), [np.asarray(p, dtype=np.float64)
+                                                                       for p in polygons]))
+
+    def add_circles(self, color, centers, radii):
+        self.layers.append(("circles", tuple(int(c) for c in color),
+                            (np.asarray(centers, dtype=np.float64).reshape(-1, 2),
+                             np.asarray(radii, dtype=np.float64).reshape(-1))))
+
+    def size_mm(self, width_mm=None):
+        # 物理尺寸（毫米），只给宽度时按画布比例计算高度
+        if width_mm is None:
+            width_mm = self.width / UNITS_PER_INCH * MM_PER_INCH
+        return width_mm, width_mm * self.height / self.width
+
+    def to_svg(self, output_path, width_mm=None):
+        width_mm, height_mm = self.size_mm(width_mm)
+        parts = [
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{_num(width_mm)}mm" height="{_num(height_mm)}mm" '
+            f'viewBox="0 0 {_num(self.width)} {_num(self.height)}">',
+            f'<rect width="100%" height="100%" fill="{_hex(self.background)}"/>',
+        ]
+        for kind, color, shapes in self.layers:
+            if kind == "polygons":
+                d = "".join("M" + " ".join(f"{_num(x)} {_num(y)}" for x, y in ring) + "Z"
+                            for ring in merge_polygons(shapes))
+                parts.append(f'<path fill="{_hex(color)}" d="{d}"/>')
+            else:
+                circles = "".join(f'<circle cx="{_num(x)}" cy="{_num(y)}" r="{_num(r)}"/>'
+                                  for (x, y), r in zip(*shapes))
+                parts.append(f'<g fill="{_hex(color)}">{circles}</g>')
+        parts.append('</svg>\n')
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(parts))
+        return output_path
+
+    def _pdf_content(self):
+        ops = ["%s %s %s rg 0 0 %s %s re f" % (*(_num(c / 255) for c in self.background), _num(self.width),
+                                                _num(self.height))]
+        k = _BEZIER_CIRCLE
+        for kind, color, shapes in self.layers:
+            ops.append("%s %s %s rg" % tuple(_num(c / 255) for c in color))
+            if kind == "polygons":
+                for ring in merge_polygons(shapes):
+                    ops.append(f"{_num(ring[0, 0])} {_num(ring[0, 1])} m "
+                               + " ".join(f"{_num(x)} {_num(y)} l" for x, y in ring[1:]) + " h")
+            else:
+                for (x, y), r in zip(*shapes):
+                    ops.append(" ".join([
+                        f"{_num(x + r)} {_num(y)} m",
+                        f"{_num(x + r)} {_num(y + k * r)} {_num(x + k * r)} {_num(y + r)} {_num(x)} {_num(y + r)} c",
+                        f"{_num(x - k * r)} {_num(y + r)} {_num(x - r)} {_num(y + k * r)} {_num(x - r)} {_num(y)} c",
+                        f"{_num(x - r)} {_num(y - k * r)} {_num(x - k * r)} {_num(y - r)} {_num(x)} {_num(y - r)} c",
+                        f"{_num(x + k * r)} {_num(y - r)} {_num(x + r)} {_num(y - k * r)} {_num(x + r)} {_num(y)} c h",
+                    ]))
+            ops.append("f")
+        return "\n".join(ops)
+
+    def to_pdf(self, output_path, width_mm=None):
+        width_mm, height_mm = self.size_mm(width_mm)
+        page_width, page_height = width_mm / MM_PER_INCH * 72, height_mm / MM_PER_INCH * 72
+        # 单位坐标 y 轴向下，变换到 PDF 的点坐标（y 轴向上）
+        scale = page_width / self.width
+        # 变换矩阵保留更多位小数，否则缩小打印时整体尺寸会偏差
+        content = f"q {scale:.6f} 0 0 {-scale:.6f} 0 {page_height:.4f} cm\n{self._pdf_content()}\nQ"
+        stream = zlib.compress(content.encode('ascii'), 9)
+        objects = [
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+            ("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %s %s] /Resources << >> /Contents 4 0 R >>"
+             % (_num(page_width), _num(page_height))).encode('ascii'),
+            b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream",
+        ]
+        data = bytearray(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(data))
+            data += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+        xref = len(data)
+        data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+        data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+        data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+        with open(output_path, 'wb') as f:
+            f.write(data)
+        return output_path
+
+    def rasterize(self, dpi, width_mm=None, antialias=3):
+        """
+        Draws the geometry at dpi for the physical width width_mm (see
+        size_mm), supersampled antialias times per axis and box filtered.
+
+        Returns:
+        - The uint8 RGB image.
+        """
+        width_mm, height_mm = self.size_mm(width_mm)
+        width_px = max(1, int(round(width_mm / MM_PER_INCH * dpi)))
+        height_px = max(1, int(round(height_mm / MM_PER_INCH * dpi)))
+        scale_x, scale_y = width_px * antialias / self.width, height_px * antialias / self.height
+        image = Image.new("RGB", (width_px * antialias, height_px * antialias), self.background)
+        draw = ImageDraw.Draw(image)
+        for kind, color, shapes in self.layers:
+            if kind == "polygons":
+                # 栅格化时逐个画原始多边形，不需要处理合并后的孔洞
+                for polygon in shapes:
+                    draw.polygon([(x * scale_x, y * scale_y) for x, y in polygon], fill=color)
+            else:
+                for (x, y), r in zip(*shapes):
+                    draw.ellipse([(x - r) * scale_x, (y - r) * scale_y, (x + r) * scale_x, (y + r) * scale_y],
+                                 fill=color)
+        if antialias > 1:
+            image = image.reduce(antialias)
+        return np.asarray(image)
+
+
+def voronoi_geometry(csv_file_path, width=1024, height=768, seed=None):
+    """
+    The coloured Voronoi pattern of generate_colored_voronoi_raster (the same
+    seed gives the same pattern) as one polygon layer per colour.
+    """
+    _, vor, point_colors = voronoi_seeds(csv_file_path, width, height, seed)
+    by_color = defaultdict(list)
+    for point, region_index in enumerate(vor.point_region):
+        region = vor.regions[region_index]
+        if -1 in region or len(region) == 0:
+            continue
+        by_color[tuple(point_colors[point])].append(vor.vertices[region])
+
+    geometry = BookmarkGeometry(width, height)
+    # 各区域互不重叠，图层顺序不影响结果，按颜色排序使输出稳定
+    for color in sorted(by_color):
+        geometry.add_polygons(color, by_color[color])
+    return geometry
+
+
+def floral_geometry(csv_file_path, size=1024, extent=None, resolve=False, gap=0.0):
+    """
+    The circles of generate_floral_pattern, scaled so that the longer side
+    of the canvas is size units; the parameters are those of
+    generate_floral_pattern. Consecutive circles of one colour share a layer.
+    """
+    centers, radii, colors = floral_circles(csv_file_path, resolve, gap)
+    if extent is None:
+        xmin, xmax, ymin, ymax = floral_extent(centers, radii)
+    else:
+        xmin, xmax, ymin, ymax = -extent, extent, -extent, extent
+    scale = size / max(xmax - xmin, ymax - ymin)
+    # y 轴向上的布局坐标转换为 y 轴向下的画布坐标
+    canvas_centers = np.column_stack([(centers[:, 0] - xmin) * scale, (ymax - centers[:, 1]) * scale])
+    geometry = BookmarkGeometry((xmax - xmin) * scale, (ymax - ymin) * scale)
+
+    start = 0
+    for end in range(1, len(colors) + 1):
+        if end == len(colors) or tuple(colors[end]) != tuple(colors[start]):
+            geometry.add_circles(colors[start], canvas_centers[start:end], radii[start:end] * scale)
+            start = end
+    return geometry
+
+
+def export_bookmark(geometry, output_stem, formats=VECTOR_FORMATS, dpis=(), width_mm=None):
+    """
+    Writes one geometry in every requested format and resolution.
+
+    Parameter:
+    - geometry: A BookmarkGeometry, e.g. from voronoi_geometry.
+    - output_stem: The path without extension; rasters get a _<dpi>dpi
+      suffix, e.g. bookmark_300dpi.png.
+    - formats: Vector formats from VECTOR_FORMATS.
+    - dpis: The resolutions of the PNG rasters.
+    - width_mm: The printed width; None uses UNITS_PER_INCH.
+
+    Returns:
+    - The paths written.
+    """
+    unknown = set(formats) - set(VECTOR_FORMATS)
+    if unknown:
+        raise ValueError(f"unknown vector format(s) {sorted(unknown)}, expected some of {VECTOR_FORMATS}")
+    os.makedirs(os.path.dirname(os.path.abspath(output_stem)), exist_ok=True)
+    paths = []
+    if "svg" in formats:
+        paths.append(geometry.to_svg(output_stem + ".svg", width_mm))
+    if "pdf" in formats:
+        paths.append(geometry.to_pdf(output_stem + ".pdf", width_mm))
+    for dpi in dpis:
+        path = f"{output_stem}_{dpi}dpi.png"
+        Image.fromarray(geometry.rasterize(dpi, width_mm)).save(path, dpi=(dpi, dpi))
+        paths.append(path)
+    return paths
@@ -0,0 +1,188 @@
+"""Concurrent, batched Google Vision image_properties requests, and a local fake."""
+
+import asyncio
+import io
+import random
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+from .colors import extract_dominant_colors, vision_color_matrix
+from .profiling import span
+
+# batch_annotate_images 每次请求最多 16 张图片
+VISION_BATCH_SIZE = 16
+
+
+class TransientVisionError(Exception):
+    """A failure worth retrying, raised by FakeVisionClient."""
+
+
+def _is_retryable(exc):
+    if isinstance(exc, (TransientVisionError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    try:
+        from google.api_core import exceptions
+    except ImportError:
+        return False
+    return isinstance(exc, (exceptions.ServiceUnavailable, exceptions.DeadlineExceeded,
+                            exceptions.ResourceExhausted, exceptions.InternalServerError))
+
+
+def _read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _image_properties_request(content):
+    return {"image": {"content": content}, "features": [{"type_": "IMAGE_PROPERTIES"}]}
+
+
+def _default_client():
+    from google.cloud import vision
+
+    return vision.ImageAnnotatorAsyncClient()
+
+
+async def annotate_image_properties(image_paths, threshold, client=None, on_result=None,
+                                    batch_size=VISION_BATCH_SIZE, max_concurrency=4, max_retries=5,
+                                    backoff=1.0, timeout=60.0):
+    """
+    Requests the dominant colours of many images from Google Vision with one
+    client, batch_annotate_images calls of up to batch_size images, at most
+    max_concurrency calls in flight, and exponential backoff with jitter on
+    transient errors.
+
+    Parameter:
+    - image_paths: The images to annotate.
+    - threshold: Colours with a pixel fraction below it are dropped.
+    - client: An async client with batch_annotate_images, e.g.
+      FakeVisionClient; defaults to a new vision.ImageAnnotatorAsyncClient.
+    - on_result: Called as on_result(image_path, color_matrix) as soon as
+      the batch of an image returns, e.g. to write its CSV.
+    - batch_size: The number of images per request, at most 16.
+    - max_concurrency: The number of requests in flight.
+    - max_retries: Retries of a request before its error is raised.
+    - backoff: The first retry delay in seconds, doubled on every retry.
+    - timeout: The timeout of a single request in seconds.
+
+    Returns:
+    - A dict of image_path -> [r, g, b, pixel_fraction] matrix, like
+      detect_image_properties_vision. Images Vision reports an error for
+      get an empty matrix.
+    """
+    if client is None:
+        client = _default_client()
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    results = {}
+
+    async def annotate_batch(paths):
+        async with semaphore:
+            # 文件读取放到线程中，不阻塞事件循环
+            contents = await asyncio.gather(*[loop.run_in_executor(None, _read_bytes, path) for path in paths])
+            request = {"requests": [_image_properties_request(content) for content in contents]}
+            for attempt in range(max_retries + 1):
+                try:
+                    with span("vision_request", count=len(paths)):
+                        response = await asyncio.wait_for(client.batch_annotate_images(request=request), timeout)
+                    break
+                except Exception as e:
+                    if attempt == max_retries or not _is_retryable(e):
+                        raise
+                    await asyncio.sleep(backoff * 2 ** attempt * (0.5 + random.random()))
+
+        for path, image_response in zip(paths, response.responses):
+            if image_response.error.code:
+                print(f"Vision could not annotate {path}: {image_response.error.message}")
+                color_matrix = np.empty((0, 4))
+            else:
+                color_matrix = vision_color_matrix(image_response.image_properties_annotation, threshold)
+            results[path] = color_matrix
+            if on_result is not None:
+                on_result(path, color_matrix)
+
+    image_paths = list(image_paths)
+    await asyncio.gather(*[annotate_batch(image_paths[i:i + batch_size])
+                           for i in range(0, len(image_paths), batch_size)])
+    return results
+
+
+def run_coroutine(coroutine):
+    # Colab/Jupyter 中已有事件循环在运行，此时在单独的线程中运行
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coroutine).result()
+
+
+def detect_image_properties_batch(image_paths, threshold, client_factory=None, **kwargs):
+    """
+    Synchronous wrapper of annotate_image_properties that also works inside
+    a notebook. client_factory is called inside the event loop to create the
+    client (gRPC async clients are bound to the loop they are created in).
+    """
+    async def annotate():
+        client = client_factory() if client_factory is not None else None
+        return await annotate_image_properties(image_paths, threshold, client=client, **kwargs)
+
+    return run_coroutine(annotate())
+
+
+class FakeVisionClient:
+    """
+    A local stand-in for vision.ImageAnnotatorAsyncClient in tests and dry
+    runs. batch_annotate_images computes the dominant colours with
+    extract_dominant_colors and returns objects shaped like the Vision
+    response, so no credentials or network are needed.
+
+    Parameter:
+    - latency: Seconds every call waits, to mimic a round trip.
+    - fail_first: The number of first calls that raise TransientVisionError,
+      to exercise the retries.
+    - n_colors: The number of dominant colours returned per image.
+
+    calls and max_in_flight record the calls made and the highest number of
+    concurrent calls seen.
+    """
+    def __init__(self, latency=0.0, fail_first=0, n_colors=10):
+        self.latency = latency
+        self.fail_first = fail_first
+        self.n_colors = n_colors
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def batch_annotate_images(self, request=None, **kwargs):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            if self.calls <= self.fail_first:
+                raise TransientVisionError("fake transient failure")
+            contents = [r["image"]["content"] for r in request["requests"]]
+            responses = await asyncio.get_running_loop().run_in_executor(None, self._annotate_all, contents)
+            return SimpleNamespace(responses=responses)
+        finally:
+            self.in_flight -= 1
+
+    def _annotate_all(self, contents):
+        return [self._annotate(content) for content in contents]
+
+    def _annotate(self, content):
+        no_error = SimpleNamespace(code=0, message="")
+        try:
+            rgb = np.asarray(Image.open(io.BytesIO(content)).convert('RGB'))
+        except OSError as e:
+            return SimpleNamespace(error=SimpleNamespace(code=3, message=str(e)), image_properties_annotation=None)
+        colors = [
+            SimpleNamespace(color=SimpleNamespace(red=r, green=g, blue=b), pixel_fraction=fraction)
+            for r, g, b, fraction in extract_dominant_colors(rgb, 0.0, n_colors=self.n_colors)
+        ]
+        annotation = SimpleNamespace(dominant_colors=SimpleNamespace(colors=colors))
+        return SimpleNamespace(error=no_error, image_properties_annotation=annotation)
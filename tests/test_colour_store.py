@@ -0,0 +1,44 @@
+"""Tests of ColourStore recovering from interrupted writes."""
+
+import numpy as np
+
+from plant_bookmark.colour_store import ColourStore
+
+COLORS = [[200, 30, 30, 0.5], [30, 200, 30, 0.3], [10, 10, 10, 0.2]]
+
+
+def test_partial_index_line_is_dropped(tmp_path):
+    store = ColourStore(str(tmp_path))
+    store.append("a.png", COLORS)
+    store.append("b.png", COLORS[:2])
+
+    # 模拟写索引时中断：最后一行只写了一半，没有换行符
+    with open(store.index_path, "a", encoding="utf-8") as f:
+        f.write("c.png,5,")
+    with open(store.records_path, "ab") as f:
+        f.write(b"\0" * 7)
+
+    store = ColourStore(str(tmp_path))
+    assert store.ids == ["a.png", "b.png"]
+    np.testing.assert_allclose(store.color_matrix("b.png"), np.asarray(COLORS[:2]))
+    with open(store.index_path, encoding="utf-8") as f:
+        assert f.read().endswith("\n")
+
+    store.append("c.png", COLORS)
+    store = ColourStore(str(tmp_path))
+    assert store.ids == ["a.png", "b.png", "c.png"]
+    np.testing.assert_allclose(store.color_matrix("c.png"), np.asarray(COLORS))
+    assert len(store.records()) == 8
+
+
+def test_truncated_count_is_not_trusted(tmp_path):
+    store = ColourStore(str(tmp_path))
+    store.append("a.png", COLORS)
+    store.append("b.png", COLORS)
+
+    # 行尾缺了换行符时，数字本身也可能被截短（"3" 可能是 "30" 的一半）
+    with open(store.index_path, "rb+") as f:
+        f.truncate(len(f.read()) - 2)
+
+    store = ColourStore(str(tmp_path))
+    assert store.ids == ["a.png"]
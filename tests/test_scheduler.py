@@ -0,0 +1,26 @@
+"""Tests of the CPU budget of the batch scheduler."""
+
+import pytest
+
+from plant_bookmark.scheduler import cpu_budget
+
+
+@pytest.mark.parametrize("n_cpus", [4, 8, 16, 32, 64])
+def test_threads_fit_the_cpus(n_cpus):
+    segment_workers, io_workers, torch_threads, decode_threads = cpu_budget(n_cpus)
+    assert segment_workers * (torch_threads + decode_threads) + io_workers <= n_cpus
+    assert min(segment_workers, io_workers, torch_threads, decode_threads) >= 1
+
+
+def test_requested_values_are_respected_and_capped():
+    segment_workers, io_workers, torch_threads, decode_threads = cpu_budget(16, segment_workers=2, io_workers=4,
+                                                                            num_workers=8)
+    assert (segment_workers, io_workers) == (2, 4)
+    # 每个分割进程分到 6 个 CPU，解码线程不超过其中的四分之一
+    assert decode_threads == 1
+    assert torch_threads == 5
+
+
+def test_single_pool_uses_all_cpus():
+    segment_workers, _, torch_threads, decode_threads = cpu_budget(16, both_pools=False)
+    assert segment_workers * (torch_threads + decode_threads) == 16
@@ -0,0 +1,74 @@
+"""Tests of the batched Vision requests against FakeVisionClient."""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from plant_bookmark.vision import FakeVisionClient, TransientVisionError, detect_image_properties_batch
+
+COLORS = [(200, 30, 30), (30, 200, 30), (30, 30, 200), (200, 200, 30), (30, 200, 200), (200, 30, 200), (90, 90, 90)]
+
+
+@pytest.fixture
+def image_paths(tmp_path):
+    # 每张图片一个纯色，可以从结果中认出是哪张图片
+    paths = []
+    for i, color in enumerate(COLORS):
+        path = tmp_path / f"image_{i}.png"
+        Image.new("RGB", (16, 16), color).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def annotate(image_paths, client, **kwargs):
+    return detect_image_properties_batch(image_paths, 0.0, client_factory=lambda: client, backoff=0.0, **kwargs)
+
+
+def test_results_belong_to_their_images(image_paths):
+    client = FakeVisionClient(n_colors=1)
+    seen = []
+    results = annotate(image_paths, client, batch_size=3, on_result=lambda path, colors: seen.append(path))
+
+    # 7 张图片分成 3 个请求
+    assert client.calls == 3
+    assert sorted(seen) == sorted(image_paths)
+    assert set(results) == set(image_paths)
+    for path, color in zip(image_paths, COLORS):
+        np.testing.assert_allclose(results[path][0], list(color) + [1.0])
+
+
+def test_transient_errors_are_retried(image_paths):
+    client = FakeVisionClient(fail_first=2, n_colors=1)
+    results = annotate(image_paths, client, batch_size=len(image_paths))
+
+    assert client.calls == 3
+    assert set(results) == set(image_paths)
+
+
+def test_retries_are_bounded(image_paths):
+    client = FakeVisionClient(fail_first=10, n_colors=1)
+    with pytest.raises(TransientVisionError):
+        annotate(image_paths, client, batch_size=len(image_paths), max_retries=2)
+    assert client.calls == 3
+
+
+class FailingClient(FakeVisionClient):
+    async def batch_annotate_images(self, request=None, **kwargs):
+        self.calls += 1
+        raise ValueError("invalid request")
+
+
+def test_other_errors_are_not_retried(image_paths):
+    client = FailingClient()
+    with pytest.raises(ValueError):
+        annotate(image_paths, client, batch_size=len(image_paths))
+    assert client.calls == 1
+
+
+def test_concurrency_is_bounded(image_paths):
+    client = FakeVisionClient(latency=0.05, n_colors=1)
+    results = annotate(image_paths, client, batch_size=1, max_concurrency=2)
+
+    assert client.calls == len(image_paths)
+    assert client.max_in_flight == 2
+    assert set(results) == set(image_paths)